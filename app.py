@@ -6,7 +6,6 @@ import streamlit as st
 import os
 import sys
 from pathlib import Path
-from dotenv import load_dotenv
 from streamlit_javascript import st_javascript
 
 # ─────────────────────────────────────────────
@@ -16,44 +15,36 @@ _project_root = str(Path(__file__).resolve().parent)
 if _project_root not in sys.path:
     sys.path.insert(0, _project_root)
 
-load_dotenv()
+@st.cache_resource(show_spinner=False)
+def _bootstrap_env() -> bool:
+    """.env 読み込みと st.secrets の環境変数への転写 (プロセスごとに1回)。クラウドモードかを返す"""
+    # .env の読み込み (logic 側の各モジュールも同じ logic.load_env を使う)
+    import logic
+    logic.load_env()
 
-# st.secrets転写
-try:
-    for key in st.secrets:
-        if isinstance(st.secrets[key], str) and key not in os.environ:
-            os.environ[key] = st.secrets[key]
-except Exception:
-    pass
+    # logic 配下のログ出力 (QueueHandler 経由で解析スレッドをブロックしない)
+    logic.configure_logging()
+
+    # st.secrets転写
+    try:
+        for key in st.secrets:
+            if isinstance(st.secrets[key], str) and key not in os.environ:
+                os.environ[key] = st.secrets[key]
+    except Exception:
+        pass
+
+    return os.environ.get("USE_CLOUD_BACKEND", "false").lower() == "true"
 
-USE_CLOUD_BACKEND = os.environ.get("USE_CLOUD_BACKEND", "false").lower() == "true"
+
+USE_CLOUD_BACKEND = _bootstrap_env()
 
 # ─────────────────────────────────────────────
 # Step 2: Logicモジュールのロード
 # ─────────────────────────────────────────────
-# Streamlit CloudでのImport Error回避のため、必要に応じてdirect_loadするが、
-# 今回はlogicパッケージがsys.pathにあるため通常importを試みる。
-# 失敗した場合のみbypassロジックを使う構造にするのが安全だが、
-# 既存の構造を維持して確実にロードする。
-
-import importlib.util
-
-_logic_dir = Path(__file__).resolve().parent / "logic"
-
-def _ensure_logic_loaded():
-    """logicパッケージが正しくロードされているか確認"""
-    if "logic" not in sys.modules:
-        # package init
-        spec = importlib.util.spec_from_file_location("logic", str(_logic_dir / "__init__.py"), submodule_search_locations=[str(_logic_dir)])
-        mod = importlib.util.module_from_spec(spec)
-        sys.modules["logic"] = mod
-        spec.loader.exec_module(mod)
-
-try:
-    _ensure_logic_loaded()
-    from logic import models, dummy_data # dummy_data is optional
-except ImportError:
-    pass # 続行
+# 標準のインポート機構に任せる (2回目以降は sys.modules を引くだけ)
+# サブモジュールは logic/__init__.py の遅延インポートで必要になった時に読み込まれる
+# (_project_root は Step 1 で sys.path に追加済み)
+import logic
 
 if USE_CLOUD_BACKEND:
     try:
@@ -97,13 +88,13 @@ detected_mode = get_device_type()
 # ユーザーが手動で切り替えている場合はそちらを優先（st.session_state.user_mode）
 current_mode = st.session_state.user_mode or detected_mode
 
-# UIモジュールのインポート（ここで呼ぶことで、app.pyの初期化完了後に実行される）
-from ui.mobile import render_mobile
-from ui.desktop import render_desktop
-
+# UIモジュールは使う方だけインポート（app.pyの初期化完了後に実行される）
+# (2回目以降の import は sys.modules を引くだけ)
 if current_mode == "mobile":
+    from ui.mobile import render_mobile
     render_mobile(USE_CLOUD_BACKEND)
 else:
+    from ui.desktop import render_desktop
     render_desktop(USE_CLOUD_BACKEND)
 
 # Footer / Debug
@@ -1,8 +1,8 @@
 
-import json
-import os
 from pathlib import Path
 
+from logic.data_layer import iter_local_summaries
+
 OUTPUT_DIR = Path("output")
 
 def _find_sessions() -> list[dict]:
@@ -12,24 +12,19 @@ def _find_sessions() -> list[dict]:
     if not OUTPUT_DIR.exists():
         print("OUTPUT_DIR does not exist!")
         return []
-        
-    for summary_path in sorted(OUTPUT_DIR.glob("*/summary.json")):
-        print(f"DEBUG: Found {summary_path}")
-        try:
-            with open(summary_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            sessions.append({
-                "dir": summary_path.parent.name,
-                "file": data.get("file", ""),
-                "total": data.get("total_receipts", 0),
-                "valid": data.get("valid_count", 0),
-                "invalid": data.get("invalid_count", 0),
-                "path": str(summary_path),
-            })
-            print(f"DEBUG: Loaded {summary_path}")
-        except Exception as e:
-            print(f"DEBUG: Error loading {summary_path}: {e}")
-            pass
+
+    # data_layer / session_manager と同じ列挙処理 (scandir + orjson) を使う
+    # summary.json の読み込みは I/O 待ちが主なのでスレッドで並列化
+    for name, summary_path, data in iter_local_summaries(str(OUTPUT_DIR), max_workers=8):
+        sessions.append({
+            "dir": name,
+            "file": data.get("file", ""),
+            "total": data.get("total_receipts", 0),
+            "valid": data.get("valid_count", 0),
+            "invalid": data.get("invalid_count", 0),
+            "path": summary_path,
+        })
+        print(f"DEBUG: Loaded {summary_path}")
     return sessions
 
 if __name__ == "__main__":
@@ -1 +1,66 @@
 # logic パッケージ
+# サブモジュールは属性として初めて参照された時にインポートする (PEP 562)
+import importlib
+import logging
+import logging.handlers
+import os
+import queue
+
+_lazy_imports = {
+    "models": "logic.models",
+    "data_layer": "logic.data_layer",
+    "database": "logic.database",
+    "storage": "logic.storage",
+    "exporter": "logic.exporter",
+    "jsonutil": "logic.jsonutil",
+    "gemini_client": "logic.gemini_client",
+    "session_manager": "logic.session_manager",
+}
+
+
+def __getattr__(name):
+    if name not in _lazy_imports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    mod = importlib.import_module(_lazy_imports[name])
+    globals()[name] = mod
+    return mod
+
+
+_env_loaded = False
+
+
+def load_env():
+    """.env を環境変数に読み込む (プロセスごとに1回)。
+
+    app.py と、logic を単体で使うスクリプトの両方から呼ばれる。
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    _env_loaded = True
+
+
+_log_listener = None
+
+
+def configure_logging(level=None):
+    """logic 配下のログを標準エラーに出す (プロセスごとに1回)。
+
+    出力は QueueHandler 経由で別スレッドに任せ、解析スレッドが書き込みで待たされないようにする。
+    level 省略時は環境変数 LOG_LEVEL (既定 INFO)。
+    """
+    global _log_listener
+    logger = logging.getLogger(__name__)
+    logger.setLevel(level or os.environ.get("LOG_LEVEL", "INFO").upper())
+    if _log_listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    _log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
@@ -4,18 +4,25 @@ Data Abstraction Layer
 - LOCAL: ファイルベース (summary.json)
 - CLOUD: Turso + R2
 """
+import copy
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
-from dotenv import load_dotenv
+from typing import Iterator, Optional
+from logic import jsonutil, load_env
 
-load_dotenv()
+load_env()
 
 # Cloud backend flag
 USE_CLOUD_BACKEND = os.getenv("USE_CLOUD_BACKEND", "false").lower() == "true"
 
+# ビューア用に公開する画像の配置先 (static/receipts/<セッションID>/)
+STATIC_IMAGE_DIR = Path(__file__).resolve().parent.parent / "static" / "receipts"
+
 # 遅延インポート: database / storage はモジュールレベルでインポートしない
 # 関数呼び出し時に初めてインポートすることで、インポート連鎖エラーを防止
 _db = None
@@ -38,44 +45,130 @@ def _get_storage():
     return _storage
 
 
+# 署名付きURLのキャッシュ: object_key → (URL, 再署名が必要になる時刻)
+# URLの有効期限 (3600秒) より手前で再署名する。件数が上限を超えたら期限切れから捨てる
+_PRESIGN_TTL = 3000
+_PRESIGN_MAX_ENTRIES = 1024
+_presigned: dict = {}
+
+
+def _presign(object_key: str, now: Optional[float] = None) -> str:
+    """署名付きURLを取得 (有効期間内は同じURLを再利用)"""
+    if now is None:
+        now = time.time()
+    cached = _presigned.get(object_key)
+    if cached and cached[1] > now:
+        return cached[0]
+    url = _get_storage().get_presigned_url(object_key)
+    if len(_presigned) >= _PRESIGN_MAX_ENTRIES:
+        _evict_presigned(now)
+    _presigned[object_key] = (url, now + _PRESIGN_TTL)
+    return url
+
+
+def _presign_many(object_keys: list[str], now: Optional[float] = None) -> list[str]:
+    """複数キーの署名付きURLを取得 (キャッシュにないものだけまとめて署名)"""
+    if now is None:
+        now = time.time()
+    # 結果は手元の dict から組み立てる (途中の削除でヒット分を失わないため)
+    urls = {}
+    missing = []
+    for key in object_keys:
+        cached = _presigned.get(key)
+        if cached and cached[1] > now:
+            urls[key] = cached[0]
+        elif key not in urls:
+            urls[key] = None
+            missing.append(key)
+    if missing:
+        if len(_presigned) + len(missing) > _PRESIGN_MAX_ENTRIES:
+            _evict_presigned(now, keep=frozenset(urls))
+        for key, url in zip(missing, _get_storage().get_presigned_urls(missing)):
+            urls[key] = url
+            _presigned[key] = (url, now + _PRESIGN_TTL)
+    return [urls[key] for key in object_keys]
+
+
+def _evict_presigned(now: float, keep: frozenset = frozenset()):
+    """
+    期限切れを削除し、それでも上限なら古い順 (挿入順) に半分捨てる。
+    keep のキー (呼び出し側がこの後読むもの) は期限内なら残す。
+    """
+    for key in [k for k, (_, exp) in _presigned.items() if exp <= now]:
+        del _presigned[key]
+    if len(_presigned) >= _PRESIGN_MAX_ENTRIES:
+        victims = [k for k in _presigned if k not in keep][:_PRESIGN_MAX_ENTRIES // 2]
+        for key in victims:
+            del _presigned[key]
+
+
+# クラウドの読み取り結果のキャッシュ: キー → (再取得が必要になる時刻, 結果)
+# Streamlit の再実行ごとのTurso往復を避ける (UI に依存しないようモジュール内の dict で持つ)。
+# 書き込み系の関数から _invalidate_cloud_reads() で破棄する
+_CLOUD_READ_TTL = 30
+_CLOUD_READ_MAX_ENTRIES = 64  # これを超えたら保存時に期限切れを捨てる
+_cloud_reads: dict = {}
+_cloud_reads_gen = 0  # 破棄のたびに進め、破棄前に読み始めた結果は保存しない
+
+
+def _cached_cloud_read(key: tuple, load):
+    """キャッシュ済みならその結果を、なければ load() を呼んで保存する (呼び出し側には複製を返す)"""
+    now = time.monotonic()
+    cached = _cloud_reads.get(key)
+    if cached and cached[0] > now:
+        return copy.deepcopy(cached[1])
+    gen = _cloud_reads_gen
+    result = load()
+    if gen == _cloud_reads_gen:
+        if len(_cloud_reads) >= _CLOUD_READ_MAX_ENTRIES:
+            for k in [k for k, (exp, _) in _cloud_reads.items() if exp <= now]:
+                del _cloud_reads[k]
+        _cloud_reads[key] = (now + _CLOUD_READ_TTL, copy.deepcopy(result))
+    return result
+
+
+def _load_cloud_receipts(session_id: str, limit: Optional[int], offset: int) -> list[dict]:
+    receipts = _get_db().get_receipts_by_session(session_id, limit, offset)
+    # 署名付きURLを更新（期限切れ対策、まとめて署名）
+    with_image = [r for r in receipts if r.get("image_url")]
+    urls = _presign_many([r["image_url"] for r in with_image])
+    for r, url in zip(with_image, urls):
+        r["image_path"] = url
+    return receipts
+
+
+def _invalidate_cloud_reads(sessions: bool = False):
+    """書き込み後にキャッシュを破棄 (sessions=True ならセッション一覧も)"""
+    global _cloud_reads_gen
+    _cloud_reads_gen += 1
+    for key in list(_cloud_reads):
+        if sessions or key[0] != "sessions":
+            _cloud_reads.pop(key, None)
+
+
 # ─────────────────────────────────────────────
 # Type definitions (for compatibility)
 # ─────────────────────────────────────────────
+@dataclass(slots=True)
 class CloudReceipt:
     """クラウド用のレシートデータ型"""
-    def __init__(self, **kwargs):
-        self.id = kwargs.get("id", str(uuid.uuid4()))
-        self.payee = kwargs.get("payee", "")  # vendor
-        self.total_amount = kwargs.get("total_amount", 0)
-        self.payment_date = kwargs.get("payment_date", "")  # date
-        self.tax_rate = kwargs.get("tax_rate", "unknown")
-        self.category = kwargs.get("category", "unknown")
-        self.payment_method = kwargs.get("payment_method", "unknown")
-        self.invoice_number = kwargs.get("invoice_number", "")
-        self.invoice_candidates = kwargs.get("invoice_candidates", [])
-        self.image_url = kwargs.get("image_url", "")  # R2のオブジェクトキー
-        self.image_path = kwargs.get("image_path", "")  # 表示用URL
-        self.status = kwargs.get("status", "valid")
-        self.is_confirmed = kwargs.get("is_confirmed", False)
-        self.is_discarded = kwargs.get("is_discarded", False)
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    payee: str = ""  # vendor
+    total_amount: int = 0
+    payment_date: str = ""  # date
+    tax_rate: str = "unknown"
+    category: str = "unknown"
+    payment_method: str = "unknown"
+    invoice_number: str = ""
+    invoice_candidates: list = field(default_factory=list)
+    image_url: str = ""  # R2のオブジェクトキー
+    image_path: str = ""  # 表示用URL
+    status: str = "valid"
+    is_confirmed: bool = False
+    is_discarded: bool = False
     
     def to_dict(self) -> dict:
-        return {
-            "id": self.id,
-            "payee": self.payee,
-            "total_amount": self.total_amount,
-            "payment_date": self.payment_date,
-            "tax_rate": self.tax_rate,
-            "category": self.category,
-            "payment_method": self.payment_method,
-            "invoice_number": self.invoice_number,
-            "invoice_candidates": self.invoice_candidates,
-            "image_url": self.image_url,
-            "image_path": self.image_path,
-            "status": self.status,
-            "is_confirmed": self.is_confirmed,
-            "is_discarded": self.is_discarded,
-        }
+        return asdict(self)
 
 
 # ─────────────────────────────────────────────
@@ -84,7 +177,9 @@ class CloudReceipt:
 def create_session(name: Optional[str] = None) -> str:
     """新しいセッションを作成"""
     if USE_CLOUD_BACKEND:
-        return _get_db().create_session(name)
+        session_id = _get_db().create_session(name)
+        _invalidate_cloud_reads(sessions=True)
+        return session_id
     else:
         # Local: フォルダ作成
         session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -93,48 +188,110 @@ def create_session(name: Optional[str] = None) -> str:
         return session_id
 
 
-def list_sessions() -> list[dict]:
-    """セッション一覧を取得"""
+def summary_wal_path(summary_path) -> str:
+    """summary.json の編集ログ (1件ごとの編集を追記) のパス"""
+    return f"{summary_path}.wal"
+
+
+def replay_summary_wal(summary_path, data: dict) -> bool:
+    """
+    編集ログを summary.json の内容 (dict) に順に適用する。
+    レコードの差し替えに加え、valid_count / invalid_count も最新の値にする。
+    編集ログがあれば True
+    """
+    try:
+        with open(summary_wal_path(summary_path), "rb") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return False
+    raw_records = data.get("records", [])
+    for line in lines:
+        try:
+            entry = jsonutil.loads(line)
+        except ValueError:
+            # 書き込み途中で落ちた末尾行は無視
+            continue
+        idx = entry.get("idx", -1)
+        if 0 <= idx < len(raw_records):
+            raw_records[idx] = entry["record"]
+        if "valid_count" in entry:
+            data["valid_count"] = entry["valid_count"]
+            data["invalid_count"] = entry["invalid_count"]
+    return True
+
+
+def _read_summary(summary_path: str) -> Optional[dict]:
+    """summary.json を読み込み編集ログを適用する (orjson優先、読めなければ None)"""
+    try:
+        with open(summary_path, "rb") as f:
+            raw = f.read()
+        data = jsonutil.loads(raw)
+        replay_summary_wal(summary_path, data)
+        return data
+    except (OSError, ValueError):
+        return None
+
+
+def iter_local_summaries(base_dir="output", limit: Optional[int] = None,
+                         max_workers: int = 1) -> Iterator[tuple[str, str, dict]]:
+    """
+    base_dir 配下の <セッション>/summary.json を新しい順 (フォルダ名の降順) に
+    (フォルダ名, summary.json のパス, 内容) で返す。読めないものは飛ばす。
+    scandir でフォルダを列挙し (Path生成・余分な stat なし)、JSONは orjson 優先で読む。
+    max_workers > 1 ならスレッドで並列に読み込む (順序は保持、limit 指定時は逐次)。
+    """
+    try:
+        with os.scandir(base_dir) as it:
+            names = sorted((e.name for e in it if e.is_dir(follow_symlinks=False)), reverse=True)
+    except FileNotFoundError:
+        return
+
+    paths = [os.path.join(base_dir, name, "summary.json") for name in names]
+    if max_workers > 1 and limit is None and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            loaded = list(ex.map(_read_summary, paths))
+    else:
+        loaded = map(_read_summary, paths)
+
+    count = 0
+    for name, summary_path, data in zip(names, paths, loaded):
+        if limit is not None and count >= limit:
+            return
+        if data is None:
+            continue
+        count += 1
+        yield name, summary_path, data
+
+
+def list_sessions(limit: Optional[int] = None) -> list[dict]:
+    """セッション一覧を取得 (新しい順、limit 指定時はその件数まで)"""
     if USE_CLOUD_BACKEND:
-        return _get_db().list_sessions()
+        return _cached_cloud_read(("sessions", limit), lambda: _get_db().list_sessions(limit))
     else:
         # Local: 既存の _find_sessions と同等
-        import json
-        sessions = []
-        base_dir = Path("output")
-        if not base_dir.exists():
-            return []
-        
-        all_dirs = sorted(list(base_dir.glob("*")), reverse=True)
-        for d in all_dirs:
-            if not d.is_dir():
-                continue
-            summary_path = d / "summary.json"
-            if not summary_path.exists():
-                continue
-            try:
-                with open(summary_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                sessions.append({
-                    "id": d.name,
-                    "name": d.name,
-                    "created_at": data.get("timestamp", ""),
-                    "path": str(summary_path),
-                })
-            except Exception:
-                pass
-        return sessions
+        return [
+            {
+                "id": name,
+                "name": name,
+                "created_at": data.get("timestamp", ""),
+                "path": summary_path,
+            }
+            for name, summary_path, data in iter_local_summaries("output", limit)
+        ]
 
 
 def delete_session(session_id: str):
     """セッションを削除"""
     if USE_CLOUD_BACKEND:
         _get_db().delete_session(session_id)
+        _invalidate_cloud_reads(sessions=True)
     else:
         import shutil
         session_dir = Path("output") / session_id
         if session_dir.exists():
             shutil.rmtree(session_dir)
+        # 公開済みの画像もセッションと一緒に削除
+        shutil.rmtree(STATIC_IMAGE_DIR / Path(session_id).name, ignore_errors=True)
 
 
 # ─────────────────────────────────────────────
@@ -148,23 +305,32 @@ def save_receipt(session_id: str, receipt: dict, image_data: Optional[bytes] = N
             object_key = _get_storage().upload_image_bytes(image_data, filename)
             receipt["image_url"] = object_key
             # 署名付きURLを取得して表示用に保存
-            receipt["image_path"] = _get_storage().get_presigned_url(object_key)
+            receipt["image_path"] = _presign(object_key)
         
-        return _get_db().save_receipt(session_id, receipt)
+        receipt_id = _get_db().save_receipt(session_id, receipt)
+        _invalidate_cloud_reads()
+        return receipt_id
     else:
         # Local: summary.json に追加
         raise NotImplementedError("Local save_receipt not implemented in this layer")
 
 
-def get_receipts(session_id: str) -> list[dict]:
-    """セッションのレシートを取得"""
+def batch_upsert_receipts(session_id: str, receipts: list[dict]) -> list[str]:
+    """複数レシートをまとめて保存 ("id" ありは更新、なしは新規作成) し、IDリストを返す"""
+    if USE_CLOUD_BACKEND:
+        receipt_ids = _get_db().upsert_receipts(session_id, receipts)
+        _invalidate_cloud_reads()
+        return receipt_ids
+    else:
+        raise NotImplementedError("Use _save_records for local mode")
+
+
+def get_receipts(session_id: str, limit: Optional[int] = None, offset: int = 0) -> list[dict]:
+    """セッションのレシートを取得 (limit 指定時はそのページのみ)"""
     if USE_CLOUD_BACKEND:
-        receipts = _get_db().get_receipts_by_session(session_id)
-        # 署名付きURLを更新（期限切れ対策）
-        for r in receipts:
-            if r.get("image_url"):
-                r["image_path"] = _get_storage().get_presigned_url(r["image_url"])
-        return receipts
+        # キャッシュ内のURLは再署名まで (_PRESIGN_TTL) より十分短い期間しか使われない
+        return _cached_cloud_read(("receipts", session_id, limit, offset),
+                                  lambda: _load_cloud_receipts(session_id, limit, offset))
     else:
         raise NotImplementedError("Use _load_records for local mode")
 
@@ -173,6 +339,7 @@ def update_receipt(receipt_id: str, updates: dict):
     """レシートを更新"""
     if USE_CLOUD_BACKEND:
         _get_db().update_receipt(receipt_id, updates)
+        _invalidate_cloud_reads()
     else:
         raise NotImplementedError("Use _save_records for local mode")
 
@@ -181,6 +348,7 @@ def soft_delete_receipt(receipt_id: str):
     """レシートをソフト削除"""
     if USE_CLOUD_BACKEND:
         _get_db().soft_delete_receipt(receipt_id)
+        _invalidate_cloud_reads()
     else:
         raise NotImplementedError("Use _save_records for local mode")
 
@@ -189,6 +357,7 @@ def restore_receipt(receipt_id: str):
     """レシートを復元"""
     if USE_CLOUD_BACKEND:
         _get_db().restore_receipt(receipt_id)
+        _invalidate_cloud_reads()
     else:
         raise NotImplementedError("Use _save_records for local mode")
 
@@ -210,7 +379,7 @@ def upload_image(image_data: bytes, filename: str) -> tuple[str, str]:
     """
     if USE_CLOUD_BACKEND:
         object_key = _get_storage().upload_image_bytes(image_data, filename)
-        display_url = _get_storage().get_presigned_url(object_key)
+        display_url = _presign(object_key)
         return object_key, display_url
     else:
         raise NotImplementedError("Local image upload not implemented in this layer")
@@ -219,7 +388,7 @@ def upload_image(image_data: bytes, filename: str) -> tuple[str, str]:
 def get_image_url(object_key: str) -> str:
     """画像の表示用URLを取得"""
     if USE_CLOUD_BACKEND:
-        return _get_storage().get_presigned_url(object_key)
+        return _presign(object_key)
     else:
         # Local: ファイルパスをそのまま返す
         return object_key
@@ -4,13 +4,17 @@ Turso Database Module (HTTP REST API version)
 - WebSocket不要、シンプルで安定
 """
 import os
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from logic import jsonutil, load_env
 
-load_dotenv()
+load_env()
 
 # Streamlit Cloud対応: st.secretsとos.getenvの両方をサポート
 def _get_secret(key: str, default: str = "") -> str:
@@ -30,6 +34,22 @@ def _get_secret(key: str, default: str = "") -> str:
     
     return default
 
+# HTTPセッション (Keep-Alive でTLS接続を使い回す)
+_http_session: Optional[requests.Session] = None
+
+
+def _get_http_session() -> requests.Session:
+    """コネクションプール付きの requests.Session を取得 (プロセス内で共有)"""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+
 # Turso接続設定を取得する関数（遅延評価）
 def _get_turso_config():
     """Turso設定を取得（毎回呼び出し時に評価）"""
@@ -45,73 +65,165 @@ def _get_turso_config():
     return http_url, auth_token
 
 
-def execute_sql(sql: str, args: list = None) -> dict:
+# 型 → Turso パラメータ変換 (isinstance の連鎖ではなく type で1回引く)
+# bool は int のサブクラスだが Turso では 0/1 の integer として送る
+_PARAM_CONV = {
+    type(None): lambda a: {"type": "null"},
+    bool: lambda a: {"type": "integer", "value": "1" if a else "0"},
+    int: lambda a: {"type": "integer", "value": str(a)},
+    float: lambda a: {"type": "float", "value": a},
+    str: lambda a: {"type": "text", "value": a},
+}
+
+
+def _to_turso_param(arg) -> dict:
+    conv = _PARAM_CONV.get(type(arg))
+    if conv is not None:
+        return conv(arg)
+    # サブクラス (str系Enum等) は isinstance で判定
+    if isinstance(arg, int):
+        return {"type": "integer", "value": str(int(arg))}
+    if isinstance(arg, float):
+        return {"type": "float", "value": float(arg)}
+    if isinstance(arg, str):
+        return {"type": "text", "value": str.__str__(arg)}
+    return {"type": "text", "value": str(arg)}
+
+
+def _to_turso_args(args: Optional[list]) -> list:
+    """パラメータをTurso形式に変換"""
+    return [_to_turso_param(arg) for arg in args] if args else []
+
+
+class DatabaseError(RuntimeError):
+    """Turso がSQLの実行エラーを返した"""
+
+
+def _error_message(error: Optional[dict]) -> str:
+    return (error or {}).get("message", "unknown error")
+
+
+def _parse_stmt_result(res: Optional[dict]) -> dict:
+    """SQL1文の実行結果から {"columns": [...], "rows": [...]} を抽出"""
+    if not res:
+        return {"columns": [], "rows": []}
+    columns = [col["name"] for col in res.get("cols", [])]
+    rows = []
+    for row in res.get("rows", []):
+        row_data = []
+        for cell in row:
+            if cell.get("type") == "null":
+                row_data.append(None)
+            else:
+                row_data.append(cell.get("value"))
+        rows.append(row_data)
+    return {"columns": columns, "rows": rows}
+
+
+def _parse_result(item: dict) -> dict:
+    """pipelineレスポンスの1要素 (execute) の結果を抽出。エラーなら DatabaseError"""
+    if item.get("type") == "error":
+        raise DatabaseError(_error_message(item.get("error")))
+    return _parse_stmt_result(item.get("response", {}).get("result"))
+
+
+def _transaction_batch(stmts: list) -> dict:
     """
-    Turso HTTP API でSQLを実行
+    BEGIN → 各SQL → COMMIT を1つの batch にする
+    各ステップは直前のステップが成功した場合のみ実行し、COMMIT まで届かなければ ROLLBACK
+    """
+    steps = [{"stmt": {"sql": "BEGIN"}}]
+    for stmt in stmts:
+        steps.append({"stmt": stmt, "condition": {"type": "ok", "step": len(steps) - 1}})
+    commit_step = len(steps)
+    steps.append({"stmt": {"sql": "COMMIT"}, "condition": {"type": "ok", "step": commit_step - 1}})
+    steps.append({
+        "stmt": {"sql": "ROLLBACK"},
+        "condition": {"type": "not", "cond": {"type": "ok", "step": commit_step}},
+    })
+    return {"type": "batch", "batch": {"steps": steps}}
+
+
+def _parse_transaction_result(item: dict, n_statements: int) -> list[dict]:
+    """batch の結果から各SQLの結果を抽出 (BEGIN/COMMIT/ROLLBACK は除く)。どこかで失敗していれば DatabaseError"""
+    if item.get("type") == "error":
+        raise DatabaseError(_error_message(item.get("error")))
+    result = item.get("response", {}).get("result", {})
+    step_errors = result.get("step_errors", [])
+    # ROLLBACK (末尾) 以外のステップのエラーを確認
+    for error in step_errors[:n_statements + 2]:
+        if error:
+            raise DatabaseError(_error_message(error))
+    step_results = result.get("step_results", [])
+    if len(step_results) < n_statements + 2 or step_results[n_statements + 1] is None:
+        # COMMIT が実行されていない (条件不成立でスキップ)
+        raise DatabaseError("transaction was not committed")
+    return [_parse_stmt_result(res) for res in step_results[1:n_statements + 1]]
+
+
+def execute_many(statements: list[tuple[str, list]], transaction: bool = False) -> list[dict]:
+    """
+    複数のSQLを1回のHTTPリクエスト (pipeline) でまとめて実行
     
     Args:
-        sql: SQL文
-        args: パラメータ（?プレースホルダ用）
+        statements: [(SQL文, パラメータ), ...]
+        transaction: True なら BEGIN/COMMIT で囲む (1文でも失敗すれば ROLLBACK)
     
     Returns:
-        {"columns": [...], "rows": [...]}
+        各SQLの結果 [{"columns": [...], "rows": [...]}, ...]
+
+    Raises:
+        DatabaseError: いずれかのSQLが失敗した場合
     """
     http_url, auth_token = _get_turso_config()
     
     if not http_url or not auth_token:
         raise ValueError("TURSO_DATABASE_URL and TURSO_AUTH_TOKEN must be set in st.secrets or .env")
     
+    if not statements:
+        return []
+    
     url = f"{http_url}/v2/pipeline"
     headers = {
         "Authorization": f"Bearer {auth_token}",
         "Content-Type": "application/json"
     }
     
-    # パラメータをTurso形式に変換
-    params = []
-    if args:
-        for arg in args:
-            if arg is None:
-                params.append({"type": "null"})
-            elif isinstance(arg, int):
-                params.append({"type": "integer", "value": str(arg)})
-            elif isinstance(arg, float):
-                params.append({"type": "float", "value": arg})
-            elif isinstance(arg, str):
-                params.append({"type": "text", "value": arg})
-            else:
-                params.append({"type": "text", "value": str(arg)})
-    
-    payload = {
-        "requests": [
-            {"type": "execute", "stmt": {"sql": sql, "args": params}},
-            {"type": "close"}
-        ]
-    }
+    stmts = [{"sql": sql, "args": _to_turso_args(args)} for sql, args in statements]
+    if transaction:
+        reqs = [_transaction_batch(stmts)]
+    else:
+        reqs = [{"type": "execute", "stmt": stmt} for stmt in stmts]
+    payload = {"requests": reqs + [{"type": "close"}]}
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = _get_http_session().post(url, json=payload, headers=headers)
     response.raise_for_status()
     
-    result = response.json()
+    # 本文のバイト列を直接パース (orjson があれば標準jsonより高速)
+    result = jsonutil.loads(response.content)
     
-    # レスポンスからデータを抽出
-    if "results" in result and len(result["results"]) > 0:
-        first_result = result["results"][0]
-        if "response" in first_result and "result" in first_result["response"]:
-            res = first_result["response"]["result"]
-            columns = [col["name"] for col in res.get("cols", [])]
-            rows = []
-            for row in res.get("rows", []):
-                row_data = []
-                for cell in row:
-                    if cell.get("type") == "null":
-                        row_data.append(None)
-                    else:
-                        row_data.append(cell.get("value"))
-                rows.append(row_data)
-            return {"columns": columns, "rows": rows}
+    items = result.get("results", [])
+    if transaction:
+        if not items:
+            raise DatabaseError("empty pipeline response")
+        return _parse_transaction_result(items[0], len(statements))
+    parsed = [_parse_result(item) for item in items[:len(statements)]]
+    parsed += [{"columns": [], "rows": []}] * (len(statements) - len(parsed))
+    return parsed
+
+
+def execute_sql(sql: str, args: list = None) -> dict:
+    """
+    Turso HTTP API でSQLを実行
+    
+    Args:
+        sql: SQL文
+        args: パラメータ（?プレースホルダ用）
     
-    return {"columns": [], "rows": []}
+    Returns:
+        {"columns": [...], "rows": [...]}
+    """
+    return execute_many([(sql, args)])[0]
 
 
 # ─────────────────────────────────────────────
@@ -130,34 +242,85 @@ def create_session(name: Optional[str] = None) -> str:
     return session_id
 
 
-def list_sessions() -> list[dict]:
-    """全セッションをリストで返す"""
-    result = execute_sql(
-        "SELECT id, name, created_at FROM sessions ORDER BY created_at DESC"
-    )
+def list_sessions(limit: Optional[int] = None, offset: int = 0) -> list[dict]:
+    """全セッションをリストで返す (limit 指定時はそのページのみ)"""
+    sql = "SELECT id, name, created_at FROM sessions ORDER BY created_at DESC"
+    args = []
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        args = [limit, offset]
+    result = execute_sql(sql, args)
     return [{"id": row[0], "name": row[1], "created_at": row[2]} for row in result["rows"]]
 
 
 def delete_session(session_id: str):
-    """セッションと関連レシートを削除"""
-    execute_sql("DELETE FROM receipts WHERE session_id = ?", [session_id])
-    execute_sql("DELETE FROM sessions WHERE id = ?", [session_id])
+    """セッションと関連レシートを削除 (1リクエスト・1トランザクション)"""
+    execute_many([
+        ("DELETE FROM receipts WHERE session_id = ?", [session_id]),
+        ("DELETE FROM sessions WHERE id = ?", [session_id]),
+    ], transaction=True)
+
+
+# ─────────────────────────────────────────────
+# Timestamp
+# ─────────────────────────────────────────────
+_now_local = threading.local()
+
+
+def _now_iso() -> str:
+    """updated_at 用の現在時刻 (_frozen_now の中では固定値)"""
+    ts = getattr(_now_local, "ts", None)
+    return ts if ts is not None else datetime.now().isoformat()
+
+
+@contextmanager
+def _frozen_now():
+    """まとめて書き込む間、全レコードで同じタイムスタンプを使う"""
+    outer = getattr(_now_local, "ts", None)
+    if outer is not None:
+        yield outer
+        return
+    _now_local.ts = datetime.now().isoformat()
+    try:
+        yield _now_local.ts
+    finally:
+        _now_local.ts = None
 
 
 # ─────────────────────────────────────────────
 # Receipt CRUD
 # ─────────────────────────────────────────────
-def save_receipt(session_id: str, receipt: dict) -> str:
-    """レシートを保存し、IDを返す"""
+def _dump_candidates(candidates) -> str:
+    """invoice_candidates を JSON配列文字列に変換 (空なら "")"""
+    if not candidates:
+        return ""
+    return jsonutil.dumps(list(candidates)).decode("utf-8")
+
+
+def _load_candidates(value) -> list:
+    """invoice_candidates 列を復元 (旧形式のカンマ区切りも読める)"""
+    if not value:
+        return []
+    if value[0] == "[":
+        try:
+            return jsonutil.loads(value)
+        except ValueError:
+            pass
+    return value.split(",")
+
+
+def _save_receipt_stmt(session_id: str, receipt: dict) -> tuple[str, list, str]:
+    """save_receipt 用の (SQL, パラメータ, レシートID) を組み立てる"""
     receipt_id = receipt.get("id") or str(uuid.uuid4())
     
-    execute_sql("""
+    sql = """
         INSERT OR REPLACE INTO receipts 
         (id, session_id, payee, total_amount, payment_date, tax_rate, category, 
          payment_method, invoice_number, invoice_candidates, image_url, image_path,
          status, is_confirmed, is_discarded, updated_at)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, [
+    """
+    args = [
         receipt_id,
         session_id,
         receipt.get("payee", ""),
@@ -167,96 +330,133 @@ def save_receipt(session_id: str, receipt: dict) -> str:
         receipt.get("category", ""),
         receipt.get("payment_method", ""),
         receipt.get("invoice_number", ""),
-        ",".join(receipt.get("invoice_candidates", [])) if receipt.get("invoice_candidates") else "",
+        _dump_candidates(receipt.get("invoice_candidates")),
         receipt.get("image_url", ""),
         receipt.get("image_path", ""),
         receipt.get("status", "valid"),
         1 if receipt.get("is_confirmed") else 0,
         1 if receipt.get("is_discarded") else 0,
-        datetime.now().isoformat()
-    ])
+        _now_iso()
+    ]
+    return sql, args, receipt_id
+
+
+def save_receipt(session_id: str, receipt: dict) -> str:
+    """レシートを保存し、IDを返す"""
+    sql, args, receipt_id = _save_receipt_stmt(session_id, receipt)
+    execute_sql(sql, args)
     return receipt_id
 
 
-def get_receipts_by_session(session_id: str) -> list[dict]:
-    """セッションに属するレシートを取得"""
-    result = execute_sql("""
+def upsert_receipts(session_id: str, receipts: list[dict]) -> list[str]:
+    """
+    複数レシートを1回のリクエストでまとめて保存
+    - "id" を持つものは部分更新 (update_receipt と同じ)
+    - "id" がないものは新規作成 (save_receipt と同じ)
+    
+    Returns:
+        各レシートのID (入力と同じ順序)。すべてコミットされた場合のみ返る
+
+    Raises:
+        DatabaseError: 1件でも失敗した場合 (ロールバック済みで何も保存されていない)
+    """
+    statements = []
+    receipt_ids = []
+    with _frozen_now():
+        for receipt in receipts:
+            if receipt.get("id"):
+                stmt = _update_receipt_stmt(receipt["id"], receipt)
+                if stmt:
+                    statements.append(stmt)
+                receipt_ids.append(receipt["id"])
+            else:
+                sql, args, receipt_id = _save_receipt_stmt(session_id, receipt)
+                statements.append((sql, args))
+                receipt_ids.append(receipt_id)
+    
+    execute_many(statements, transaction=True)
+    return receipt_ids
+
+
+def get_receipts_by_session(session_id: str, limit: Optional[int] = None, offset: int = 0) -> list[dict]:
+    """セッションに属するレシートを取得 (limit 指定時はそのページのみ)"""
+    sql = """
         SELECT id, payee, total_amount, payment_date, tax_rate, category,
                payment_method, invoice_number, invoice_candidates, image_url, image_path,
-               status, is_confirmed, is_discarded, created_at, updated_at
+               status, is_confirmed, is_discarded
         FROM receipts 
         WHERE session_id = ? AND is_discarded = 0
         ORDER BY created_at
-    """, [session_id])
+    """
+    args = [session_id]
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        args += [limit, offset]
+    result = execute_sql(sql, args)
     
+    # 列名でdict化し、型変換が必要な列だけ後から直す
+    # (Turso HTTP API は整数も文字列 "0"/"1" で返すため int() を経由する)
+    columns = result["columns"]
     receipts = []
     for row in result["rows"]:
-        receipts.append({
-            "id": row[0],
-            "payee": row[1],
-            "total_amount": row[2],
-            "payment_date": row[3],
-            "tax_rate": row[4],
-            "category": row[5],
-            "payment_method": row[6],
-            "invoice_number": row[7],
-            "invoice_candidates": row[8].split(",") if row[8] else [],
-            "image_url": row[9],
-            "image_path": row[10],
-            "status": row[11],
-            "is_confirmed": bool(row[12]),
-            "is_discarded": bool(row[13]),
-        })
+        d = dict(zip(columns, row))
+        d["invoice_candidates"] = _load_candidates(d["invoice_candidates"])
+        d["is_confirmed"] = bool(int(d["is_confirmed"] or 0))
+        d["is_discarded"] = bool(int(d["is_discarded"] or 0))
+        receipts.append(d)
     return receipts
 
 
-def update_receipt(receipt_id: str, updates: dict):
-    """レシートを部分更新"""
-    set_clauses = []
-    values = []
-    
-    field_mapping = {
-        "payee": "payee",
-        "total_amount": "total_amount",
-        "payment_date": "payment_date",
-        "tax_rate": "tax_rate",
-        "category": "category",
-        "payment_method": "payment_method",
-        "invoice_number": "invoice_number",
-        "image_url": "image_url",
-        "image_path": "image_path",
-        "status": "status",
-        "is_confirmed": "is_confirmed",
-        "is_discarded": "is_discarded",
-    }
-    
-    for key, column in field_mapping.items():
-        if key in updates:
-            value = updates[key]
-            if key in ("is_confirmed", "is_discarded"):
-                value = 1 if value else 0
-            set_clauses.append(f"{column} = ?")
-            values.append(value)
-    
-    if not set_clauses:
-        return
+# update_receipt で更新可能な列 (キー名 = 列名)
+_UPDATE_FIELDS = (
+    "payee", "total_amount", "payment_date", "tax_rate", "category",
+    "payment_method", "invoice_number", "image_url", "image_path",
+    "status", "is_confirmed", "is_discarded",
+)
+_BOOL_FIELDS = frozenset(("is_confirmed", "is_discarded"))
+
+# ゴミ箱操作は1列のみなのでSQLを固定
+_SQL_SOFT_DELETE = "UPDATE receipts SET is_discarded = 1, updated_at = ? WHERE id = ?"
+_SQL_RESTORE = "UPDATE receipts SET is_discarded = 0, updated_at = ? WHERE id = ?"
+
+
+@lru_cache(maxsize=128)
+def _update_sql(columns: tuple) -> str:
+    """更新列の組み合わせごとに UPDATE 文を組み立ててキャッシュ"""
+    set_clauses = ", ".join(f"{column} = ?" for column in columns)
+    return f"UPDATE receipts SET {set_clauses}, updated_at = ? WHERE id = ?"
+
+
+def _update_receipt_stmt(receipt_id: str, updates: dict) -> Optional[tuple[str, list]]:
+    """update_receipt 用の (SQL, パラメータ) を組み立てる (更新項目がなければ None)"""
+    columns = tuple(key for key in _UPDATE_FIELDS if key in updates)
+    if not columns:
+        return None
     
-    set_clauses.append("updated_at = ?")
-    values.append(datetime.now().isoformat())
+    values = [
+        (1 if updates[key] else 0) if key in _BOOL_FIELDS else updates[key]
+        for key in columns
+    ]
+    values.append(_now_iso())
     values.append(receipt_id)
-    
-    sql = f"UPDATE receipts SET {', '.join(set_clauses)} WHERE id = ?"
-    execute_sql(sql, values)
+    return _update_sql(columns), values
+
+
+def update_receipt(receipt_id: str, updates: dict):
+    """レシートを部分更新"""
+    stmt = _update_receipt_stmt(receipt_id, updates)
+    if stmt:
+        execute_sql(*stmt)
 
 
 def soft_delete_receipt(receipt_id: str):
     """レシートをソフト削除（ゴミ箱へ）"""
-    update_receipt(receipt_id, {"is_discarded": True})
+    execute_sql(_SQL_SOFT_DELETE, [_now_iso(), receipt_id])
 
 
 def restore_receipt(receipt_id: str):
     """ゴミ箱からレシートを復元"""
-    update_receipt(receipt_id, {"is_discarded": False})
+    execute_sql(_SQL_RESTORE, [_now_iso(), receipt_id])
 
 
 def get_trashed_receipts(session_id: str) -> list[dict]:
@@ -1,4 +1,5 @@
-import pandas as pd
+import csv
+import io
 from typing import List, Dict, Optional
 from .models import ReceiptRecord, Category, PaymentMethod, TaxRate
 
@@ -48,71 +49,81 @@ TAX_RATE_MAP = {
 }
 TAX_CLASS_EXEMPT = "0" # 非課税 (仮)
 
+_CAT_GET = CATEGORY_ACCOUNT_MAP.get
+_PAY_GET = PAYMENT_ACCOUNT_MAP.get
+_TAX_GET = TAX_RATE_MAP.get
+
+# 必須項目 (ユーザー要件)
+MANDATORY_KEYS = (
+    "内部月", # Date derived
+    "借方勘定科目コード",
+    "借方金額",
+    "借方消費税区分", 
+    "借方税込/税抜区分",
+    "借方税率コード",
+    "貸方勘定科目コード",
+    "貸方金額",
+    "摘要"
+)
+
+_MANDATORY_MASK = (1 << len(MANDATORY_KEYS)) - 1
+
 def validate_mandatory_fields(row: Dict[str, str]) -> List[str]:
     """
     ユーザー要件に基づく必須項目チェック
     戻り値: 不足している項目名のリスト (空ならOK)
     """
-    required_keys = [
-        "内部月", # Date derived
-        "借方勘定科目コード",
-        "借方金額",
-        "借方消費税区分", 
-        "借方税込/税抜区分",
-        "借方税率コード",
-        "貸方勘定科目コード",
-        "貸方金額",
-        "摘要"
-    ]
-    
-    missing = []
-    for key in required_keys:
+    # 入力済みの項目をビットで記録し、全ビットが立っていれば整数比較1回で終了
+    present = 0
+    for i, key in enumerate(MANDATORY_KEYS):
         val = row.get(key)
-        if not val or str(val).strip() == "":
-            missing.append(key)
+        if val and str(val).strip():
+            present |= 1 << i
+    if present == _MANDATORY_MASK:
+        return []
     
-    return missing
+    missing_bits = _MANDATORY_MASK & ~present
+    return [key for i, key in enumerate(MANDATORY_KEYS) if missing_bits >> i & 1]
 
 def convert_record_to_row(record: ReceiptRecord) -> Dict[str, str]:
     """
     ReceiptRecordをCSV行(Dict)に変換する。
     この段階ではバリデーションエラーがあっても変換自体は行う。
     """
-    # 日付処理
-    try:
-        # YYYY/MM/DD -> YYYYMM 形式
-        # 少し堅牢にする (スラッシュ除去して6桁)
-        clean_date = record.date.replace("/", "").replace("-", "")
-        if len(clean_date) >= 6:
-            internal_month = clean_date[:6]
-        else:
-            internal_month = ""
-    except:
-        internal_month = ""
-
-    # マッピング
-    debit_code = CATEGORY_ACCOUNT_MAP.get(record.category, "")
-    credit_code = PAYMENT_ACCOUNT_MAP.get(record.payment_method, "")
+    # 日付処理: YYYY/MM/DD (YYYY-MM-DD) -> YYYYMM
+    # 定形ならスライスのみ、それ以外は区切りを除去して先頭6桁
+    d = record.date or ""
+    if len(d) >= 7 and d[4] in "/-" and d[7:8] in ("", "/", "-"):
+        internal_month = d[:4] + d[5:7]
+    else:
+        clean_date = d.replace("/", "").replace("-", "")
+        internal_month = clean_date[:6] if len(clean_date) >= 6 else ""
+
+    # マッピング (bound method をモジュールで保持)
+    debit_code = _CAT_GET(record.category, "")
+    credit_code = _PAY_GET(record.payment_method, "")
     
-    tax_rate_code = TAX_RATE_MAP.get(record.tax_rate_detected, "0")
+    tax_rate_code = _TAX_GET(record.tax_rate_detected, "0")
     
     # 摘要: vendor + subject + invoice
     summary = f"{record.vendor} {record.subject}".strip()
     if record.invoice_no_norm:
         summary += f" INVOICE:{record.invoice_no_norm}"
+
+    amount = str(record.total_amount)
         
     row = {
         "日付": record.date,
         "内部月": internal_month,
         
         "借方勘定科目コード": debit_code,
-        "借方金額": str(record.total_amount),
+        "借方金額": amount,
         "借方消費税区分": TAX_CLASS_EXEMPT if record.tax_rate_detected == TaxRate.EXEMPT else TAX_CLASS_PURCHASE,
         "借方税込/税抜区分": TAX_INC_EXC_INC, # [1] 税込
         "借方税率コード": tax_rate_code,
         
         "貸方勘定科目コード": credit_code,
-        "貸方金額": str(record.total_amount),
+        "貸方金額": amount,
         
         "摘要": summary,
         
@@ -130,32 +141,41 @@ def generate_csv_data(records: List[ReceiptRecord]) -> Dict[str, List[Dict]]:
     """
     valid_rows = []
     invalid_rows = []
-    
+
     for record in records:
         # ユーザー要件: ユーザー確認済みでないレコードはCSV出力対象から除外 (必須)
         if not record.is_confirmed:
             continue
 
+        # 必須項目チェックは revalidate_record と同じ validate_mandatory_fields を使う
         row = convert_record_to_row(record)
         missing = validate_mandatory_fields(row)
-        
         if missing:
-            # エラーあり
             record.missing_fields = missing # モデル側にも情報を戻す（表示用）
-            invalid_info = row.copy()
-            invalid_info["_error_reasons"] = missing
-            # invalid_info["_original_record"] = record # JSON serialize error回避のため除外またはstr化推奨
-            invalid_rows.append(invalid_info)
+            row["_error_reasons"] = missing
+            invalid_rows.append(row)
         else:
-            # 正常
             valid_rows.append(row)
-            
+
     return {
         "valid": valid_rows,
         "invalid": invalid_rows
     }
 
 
+def rows_to_csv_bytes(rows: List[Dict]) -> bytes:
+    """
+    CSV行のリストを BOM付きUTF-8 のCSVバイト列に変換する (Excel対応)。
+    列順は行に現れたキーの順。DataFrameを経由せず csv.DictWriter で1パス書き出す。
+    """
+    fieldnames = list(dict.fromkeys(k for row in rows for k in row))
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8-sig")
+
+
 def revalidate_record(record: ReceiptRecord) -> ReceiptRecord:
     """
     レコードの valid/invalid を再判定する（UI保存時に使用）。
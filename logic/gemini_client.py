@@ -7,22 +7,42 @@ Gemini / OpenAI デュアルバックエンド対応 OCRクライアント
 """
 import os
 import json
+import logging
 import re
 import base64
+import concurrent.futures
+import hashlib
+import threading
 import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 from PIL import Image
 import io
 import time
 import random
 import functools
-from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
+from . import jsonutil, load_env
+from tenacity import retry, stop_after_attempt, wait_exponential, wait_random, retry_if_exception
 
 from .models import ReceiptRecord, TaxRate, PaymentMethod, Category
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# pybase64 があればSIMD実装のbase64エンコードを使用 (なければ標準base64)
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+# pyahocorasick があればラベル探索を1パスで行う (なければ正規表現にフォールバック)
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+load_env()
 
 # モデル設定
 GEMINI_MODEL = "gemini-2.0-flash"
@@ -69,40 +89,166 @@ EXTRACTION_PROMPT = """
 """
 
 
+# 一時的なエラーとみなすHTTPステータス (レート制限・サーバー側の一時障害)
+_RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+_RETRYABLE_MESSAGES = (
+    "429", "quota", "rate limit", "resource exhausted", "resource_exhausted",
+    "503", "unavailable", "overloaded", "timed out", "timeout",
+    "exhausted your capacity", "model_capacity_exhausted",
+)
+# 429 応答の RetryInfo.retryDelay (例: 'retryDelay': '59s')
+_RETRY_DELAY_RE = re.compile(r"""retryDelay['"]?\s*[:=]\s*['"]?(\d+(?:\.\d+)?)s""")
+# サーバー指定の待ち時間の上限 (長すぎる指定でも最大この秒数で再試行)
+_RETRY_DELAY_MAX = 60
+
+
 def _is_retryable_error(e: Exception) -> bool:
     """
     リトライすべきエラーかどうかを判定
-    - 429 (Rate Limit)
-    - Quota Exceeded / Resource Exhausted
+    - 429 (Rate Limit) / Quota Exceeded / Resource Exhausted
+    - 5xx (Service Unavailable / Overloaded) / タイムアウト
+    認証エラーなどはリトライせず、すぐに呼び出し元 (OpenAIフォールバック) へ
     """
+    # google-genai は .code、openai は .status_code にHTTPステータスを持つ
+    for attr in ("status_code", "code"):
+        status = getattr(e, attr, None)
+        if isinstance(status, int):
+            return status in _RETRYABLE_STATUS
     err_str = str(e).lower()
-    return "429" in err_str or "quota" in err_str or "rate limit" in err_str or "resource exhausted" in err_str
+    return any(msg in err_str for msg in _RETRYABLE_MESSAGES)
+
+
+# 1回目: 2s, 2回目: 4s, 3回目: 8s (approx) + 0〜1秒のジッタ (並列実行時に再試行が揃わないように)
+_BACKOFF_WAIT = wait_exponential(multiplier=2, min=2, max=16) + wait_random(0, 1)
+
+
+def _wait_before_retry(retry_state) -> float:
+    """エラーに retryDelay があればその秒数 (+ジッタ) だけ待ち、なければ指数バックオフ"""
+    m = _RETRY_DELAY_RE.search(str(retry_state.outcome.exception()))
+    if m:
+        return min(float(m.group(1)), _RETRY_DELAY_MAX) + random.uniform(0, 1)
+    return _BACKOFF_WAIT(retry_state)
 
 
 # Common Retry Configuration
-# 1回目: 2s, 2回目: 4s, 3回目: 8s (approx)
 RETRY_DECORATOR = retry(
     stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=2, min=2, max=16),
+    wait=_wait_before_retry,
     retry=retry_if_exception(_is_retryable_error),
     reraise=True
 )
 
 
-def _image_to_base64(image_path: str) -> str:
-    """画像をbase64文字列に変換"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+# 画像入力: ファイルパス または メモリ上のバイト列 (一時ファイルを経由しない)
+ImageSource = Union[str, bytes, io.BytesIO]
+
+
+def _source_name(image: ImageSource) -> str:
+    """ログ用の表示名"""
+    return os.path.basename(image) if isinstance(image, str) else "memory"
+
 
+def _open_image(image: ImageSource) -> Image.Image:
+    """パス/バイト列どちらからでもPIL画像を開く"""
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+    elif isinstance(image, io.BytesIO):
+        image.seek(0)
+    return Image.open(image)
 
-import tempfile
 
-def _split_image(image_path: str) -> List[Tuple[str, tuple]]:
+def _read_image_bytes(image: ImageSource) -> bytes:
+    """画像のバイト列を取得"""
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            return f.read()
+    if isinstance(image, bytes):
+        return image
+    return image.getvalue()
+
+
+# ── AI応答のキャッシュ (画像内容のSHA-256 → 生レスポンス) ──
+# 同じ画像の再解析ではAPIを呼ばない。後処理 (T番号・日付) は生レスポンスから毎回やり直す
+# 応答にはレシートのOCR全文 (個人情報) が含まれるため既定は無効。
+# 有効にするには LLM_CACHE_DIR に保存先を指定する (例: LLM_CACHE_DIR=.cache/llm_responses)
+_LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+
+
+def _response_cache_key(image: ImageSource) -> str:
+    """画像バイト列・プロンプト・モデル名から応答キャッシュのキーを作る"""
+    h = hashlib.sha256(_read_image_bytes(image))
+    h.update(EXTRACTION_PROMPT.encode("utf-8"))
+    # モデルを変えたら古い応答を使わない
+    h.update(f"\0{GEMINI_MODEL}\0{OPENAI_MODEL}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _load_cached_response(key: str) -> Optional[Tuple[str, str]]:
+    """キャッシュ済みの (生レスポンス, 使用したバックエンド) を返す (なければ None)"""
+    if not _LLM_CACHE_DIR:
+        return None
+    try:
+        with open(os.path.join(_LLM_CACHE_DIR, f"{key}.json"), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        return entry["raw_text"], entry.get("backend", "")
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _store_cached_response(key: str, raw_text: str, backend: str):
+    """生レスポンスを保存 (一時ファイル → os.replace で並列実行時も壊れない)"""
+    if not _LLM_CACHE_DIR:
+        return
+    try:
+        os.makedirs(_LLM_CACHE_DIR, exist_ok=True)
+        path = os.path.join(_LLM_CACHE_DIR, f"{key}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"backend": backend, "raw_text": raw_text}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("応答キャッシュの保存に失敗: %s", e)
+
+
+# ── 送信前の縮小 ──
+# 各APIは内部で長辺2048px程度に縮小して処理するため、それより大きい画像は手元で縮小して送る
+# (アップロード量・base64変換量が減り、応答も速くなる。box_2d は0-1000正規化なので影響なし)
+_UPLOAD_MAX_SIDE = 2048
+_UPLOAD_JPEG_QUALITY = 85
+_UPLOAD_PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def _prepare_upload_image(image: ImageSource) -> Tuple[bytes, str]:
+    """API送信用の (画像バイト列, MIMEタイプ) を返す。大きい画像はJPEGに縮小"""
+    data = _read_image_bytes(image)
+    img = Image.open(io.BytesIO(data))
+    mime = _UPLOAD_PASSTHROUGH_FORMATS.get(img.format)
+    if mime and max(img.size) <= _UPLOAD_MAX_SIDE:
+        return data, mime
+
+    return _encode_upload_jpeg(img, img.info.get("exif")), "image/jpeg"
+
+
+def _encode_upload_jpeg(img: Image.Image, exif: Optional[bytes] = None) -> bytes:
+    """長辺 _UPLOAD_MAX_SIDE 以下に縮小してJPEGバイト列にする"""
+    img.thumbnail((_UPLOAD_MAX_SIDE, _UPLOAD_MAX_SIDE), Image.LANCZOS)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    save_kwargs = {"format": "JPEG", "quality": _UPLOAD_JPEG_QUALITY, "optimize": True}
+    if exif:
+        save_kwargs["exif"] = exif  # 向き情報を保持
+    img.save(buf, **save_kwargs)
+    return buf.getvalue()
+
+
+def _split_image(image_path: ImageSource) -> List[Tuple[bytes, tuple]]:
     """
-    画像を 2x2（4分割）+ 中央クロップ（1枚）の計5枚に分割して一時保存。
-    戻り値: [(一時ファイルパス, (offset_y, offset_x, original_h, original_w)), ...]
+    画像を 2x2（4分割）+ 中央クロップ（1枚）の計5枚に分割する。
+    各クロップは送信サイズに縮小したJPEGバイト列としてメモリ上に保持 (一時ファイルは作らない)
+    戻り値: [(JPEGバイト列, (offset_y, offset_x, crop_h, crop_w, original_h, original_w)), ...]
     """
-    img = Image.open(image_path)
+    img = _open_image(image_path)
     w, h = img.size
     
     # 4分割
@@ -121,18 +267,13 @@ def _split_image(image_path: str) -> List[Tuple[str, tuple]]:
     crops.append((center_x, center_y, center_x + center_w, center_y + center_h))
     
     results = []
-    # システムの一時ディレクトリを使用 (Streamlitの再読み込みループ回避)
-    temp_dir = tempfile.mkdtemp()
-    filename = os.path.splitext(os.path.basename(image_path))[0]
-    
-    for i, (x1, y1, x2, y2) in enumerate(crops):
-        crop_img = img.crop((x1, y1, x2, y2))
-        temp_path = os.path.join(temp_dir, f"{filename}_crop_{i}.jpg")
-        crop_img.save(temp_path, "JPEG")
+    for x1, y1, x2, y2 in crops:
+        # 送信前の縮小もここで済ませ、_prepare_upload_image では再エンコードしない
+        crop_data = _encode_upload_jpeg(img.crop((x1, y1, x2, y2)))
         
         # 正規化座標を復元するためのオフセット情報を保存
         # (offset_y, offset_x, crop_h, crop_w, original_h, original_w)
-        results.append((temp_path, (y1, x1, y2-y1, x2-x1, h, w)))
+        results.append((crop_data, (y1, x1, y2-y1, x2-x1, h, w)))
         
     return results
 
@@ -147,9 +288,62 @@ _INVOICE_LABEL_KEYWORDS = ["登録番号", "適格請求書発行事業者", "
 # T番号候補の正規表現 (広め)
 _T_NUMBER_PATTERN = r"[TＴ][0-9０-９\-ー－−\–\—\‐\s]{10,}"
 
+# 抽出処理で使う正規表現はモジュール読み込み時に1回だけコンパイル
+_T_NUMBER_RE = re.compile(_T_NUMBER_PATTERN)
+# T番号候補から除去する文字 (ハイフン・長音・ダッシュ系 + 空白類) の変換表
+# 空白類は str.isspace() と同じ (正規表現の \s と一致、最大は U+3000)
+_STRIP_TABLE = str.maketrans("", "", "-−ー–—‐‑‒―⁃₋﹣－" + "".join(chr(c) for c in range(0x3001) if chr(c).isspace()))
+_NONDIGIT_RE = re.compile(r"[^0-9]")
+_T_TOKEN_RE = re.compile(r"[TＴt]|[0-9０-９]+")
 
+
+def _build_label_automaton(keywords: List[str]):
+    """キーワード群の Aho–Corasick オートマトンを作る (pyahocorasick がなければ None)"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for i, kw in enumerate(keywords):
+        automaton.add_word(kw, (i, len(kw)))
+    automaton.make_automaton()
+    return automaton
+
+
+def _build_label_regex(keywords: List[str]) -> "re.Pattern":
+    """いずれかのキーワードが始まる位置に一致する正規表現 (オートマトンがない場合の1パス探索用)"""
+    # 先読みにすることで 適格請求書発行事業者 / 適格請求書 のような重なりも位置を取りこぼさない
+    return re.compile("(?=" + "|".join(map(re.escape, keywords)) + ")")
+
+
+def _find_labels(text: str, automaton, label_re: "re.Pattern", keywords: List[str]) -> List[Tuple[int, int, int]]:
+    """
+    ラベルの出現を (キーワード番号, 開始, 終了) のリストで返す (キーワード順 → 位置順)
+    オートマトンがあれば全キーワードを1回の走査で探す
+    """
+    if automaton is not None:
+        hits = [(i, end + 1 - n, end + 1) for end, (i, n) in automaton.iter(text)]
+    else:
+        # 結合した正規表現で開始位置を1回の走査で拾い、その位置で始まるキーワードを確認
+        hits = [
+            (i, pos, pos + len(kw))
+            for pos in (m.start() for m in label_re.finditer(text))
+            for i, kw in enumerate(keywords)
+            if text.startswith(kw, pos)
+        ]
+    hits.sort()
+    return hits
+
+
+_INVOICE_LABEL_RE = _build_label_regex(_INVOICE_LABEL_KEYWORDS)
+_INVOICE_LABEL_AC = _build_label_automaton(_INVOICE_LABEL_KEYWORDS)
+
+
+# 同じ候補文字列 (AI値・OCR上の同じT番号) が何度も来るので結果をキャッシュ
+@functools.lru_cache(maxsize=8192)
 def _zen_to_han(text: str) -> str:
     """全角英数字・記号を半角に変換 (NFKC正規化)"""
+    # ASCIIのみならNFKCで変化しないので正規化を省略
+    if text.isascii():
+        return text
     return unicodedata.normalize("NFKC", text)
 
 
@@ -171,16 +365,15 @@ def _normalize_invoice_candidate(raw: str) -> Tuple[str, bool]:
         return "", False
     # Step 1: 全角→半角
     s = _zen_to_han(raw)
-    # Step 2: ハイフン・長音・ダッシュ系の除去
-    s = re.sub(r"[\-−ー–—‐‑‒―⁃₋﹣－]", "", s)
-    # Step 3: スペース・改行除去
-    s = re.sub(r"[\s\u3000]", "", s).strip()
+    # Step 2-3: ハイフン・長音・ダッシュ系とスペース・改行を1パスで除去
+    s = s.translate(_STRIP_TABLE)
     # 先頭が T であることを確認
     if not s.startswith("T"):
         return "", False
     digits = s[1:]  # T以降
-    # 数字のみ抽出 (OCRノイズで記号が混入する場合)
-    digits = re.sub(r"[^0-9]", "", digits)
+    # 数字のみ抽出 (OCRノイズで記号が混入する場合のみ)
+    if not (digits.isascii() and digits.isdigit()):
+        digits = _NONDIGIT_RE.sub("", digits)
 
     if len(digits) == 13:
         # 完全一致 → 高信頼度
@@ -197,6 +390,46 @@ def _normalize_invoice_candidate(raw: str) -> Tuple[str, bool]:
         return "", False
 
 
+def _invoice_check_digit_ok(norm: str) -> bool:
+    """
+    正規化済みT番号 (T+13桁) の先頭桁が法人番号の検査用数字と一致するか
+      検査用数字 = 9 - (Σ 基礎番号12桁の各桁 × 重み) mod 9
+      重み: 基礎番号の下位の桁から数えて奇数桁は1、偶数桁は2
+    個人事業者の登録番号は法人番号ではないため、不一致でも不採用にはしない (候補の優先順位付けに使う)
+    """
+    digits = norm[1:]
+    if len(digits) != 13 or not digits.isdigit():
+        return False
+    total = sum(int(d) * (2 if n % 2 else 1) for n, d in enumerate(reversed(digits[1:])))
+    return int(digits[0]) == 9 - total % 9
+
+
+def _pick_invoice_candidate(candidates: List[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    候補から (元の文字列, 正規化済みT番号, 低信頼度フラグ) を選ぶ
+    検査用数字が一致するものを優先し、なければ最初に正規化できたもの
+    """
+    first = None
+    for cand in candidates:
+        norm, norm_low = _normalize_invoice_candidate(cand)
+        if not norm:
+            continue
+        if _invoice_check_digit_ok(norm):
+            return cand, norm, norm_low
+        if first is None:
+            first = (cand, norm, norm_low)
+    return first
+
+
+def _t_number_spans(text: str) -> List[Tuple[int, int]]:
+    """T番号候補の (開始, 終了) 位置一覧。T/Ｔ を含まないテキストは正規表現を走らせない"""
+    if "T" not in text and "Ｔ" not in text:
+        return []
+    return [m.span() for m in _T_NUMBER_RE.finditer(text)]
+
+
+# OCR全文とAI値だけで結果が決まるのでキャッシュする (複数レシートに同じ全文が付くことがある)
+@functools.lru_cache(maxsize=256)
 def _extract_invoice_no_from_text(ocr_text: str, ai_raw: str = "") -> Tuple[str, str, bool]:
     """
     T番号をラベル近傍優先で抽出する。
@@ -229,63 +462,72 @@ def _extract_invoice_no_from_text(ocr_text: str, ai_raw: str = "") -> Tuple[str,
         return "", debug_info + "OCRテキストなし", False
 
     # (2) ラベル近傍検索 (高信頼度ソース)
+    # T番号候補は全文を1回だけ走査し、各ラベルの前後60文字に始まるものを位置で絞り込む
+    t_spans = _t_number_spans(ocr_text)
+    t_starts = [s for s, _ in t_spans]
     label_windows = []
-    for kw in _INVOICE_LABEL_KEYWORDS:
-        for match in re.finditer(re.escape(kw), ocr_text):
-            start = max(0, match.start() - 60)
-            end = min(len(ocr_text), match.end() + 60)
-            window = ocr_text[start:end]
-            label_windows.append((kw, window))
+    for i, label_start, label_end in _find_labels(ocr_text, _INVOICE_LABEL_AC, _INVOICE_LABEL_RE, _INVOICE_LABEL_KEYWORDS):
+        start = max(0, label_start - 60)
+        end = min(len(ocr_text), label_end + 60)
+        label_windows.append((_INVOICE_LABEL_KEYWORDS[i], start, end))
 
     if label_windows:
         debug_info += f"ラベル {len(label_windows)} 箇所検出; "
-        for kw, window in label_windows:
-            candidates = re.findall(_T_NUMBER_PATTERN, window)
-            for cand in candidates:
-                norm, norm_low = _normalize_invoice_candidate(cand)
-                if norm:
-                    suffix = " (桁数補完・要確認)" if norm_low else ""
-                    debug_info += f"ラベル近傍'{kw}'から確定: {cand.strip()} → {norm}{suffix}"
-                    return norm, debug_info, norm_low
+        for kw, start, end in label_windows:
+            window_candidates = []
+            for s, e in t_spans[bisect_left(t_starts, start):bisect_left(t_starts, end)]:
+                # ウィンドウ末尾をまたぐ候補は窓内の部分だけを使う (窓を切り出して検索した場合と同じ)
+                if e > end:
+                    e = end
+                    if e - s < 11:  # T + 10文字に満たない
+                        continue
+                window_candidates.append(ocr_text[s:e])
+            picked = _pick_invoice_candidate(window_candidates)
+            if picked:
+                cand, norm, norm_low = picked
+                suffix = " (桁数補完・要確認)" if norm_low else ""
+                debug_info += f"ラベル近傍'{kw}'から確定: {cand.strip()} → {norm}{suffix}"
+                return norm, debug_info, norm_low
 
             # ── フォールバック: 数字ブロック結合 ──
             # 正規表現で一発で見つからない場合 (例: "T 123 456" のようにスペース過多など)
             # アルファベットT と 数字ブロックを拾って結合してみる
-            tokens = re.findall(r"[TＴt]|[0-9０-９]+", window)
+            tokens = _T_TOKEN_RE.findall(ocr_text, start, end)
+            # 各トークンの数字(半角)桁数の累積和: prefix[j] - prefix[i] で i〜j-1 の桁数が O(1) で分かる
+            prefix = [0]
+            for token in tokens:
+                n = len(token) if token.isascii() and token.isdigit() else len(_NONDIGIT_RE.sub("", token))
+                prefix.append(prefix[-1] + n)
+
             for i, token in enumerate(tokens):
                 # Tで始まるトークン、またはTそのもの
-                if not re.match(r"^[TＴt]", token):
+                if token[0] not in "TＴt":
                     continue
                 
                 # ここから後ろのトークンを順に結合してテスト (最大8トークン先まで)
-                combined = token
-                # 結合に使用した文字数(数字部分)のカウント
-                digit_count = len(re.sub(r"[^0-9]", "", combined))
-                
                 for j in range(i + 1, min(len(tokens), i + 8)):
-                    combined += tokens[j]
-                    digit_count += len(re.sub(r"[^0-9]", "", tokens[j]))
+                    digit_count = prefix[j + 1] - prefix[i]
+                    # 14桁を超えたら打ち切り
+                    if digit_count > 14:
+                        break
                     
                     # 正規化してチェック (12〜14桁ならヒットする可能性あり)
-                    if 12 <= digit_count <= 14:
+                    if digit_count >= 12:
+                        combined = "".join(tokens[i:j + 1])
                         norm, norm_low = _normalize_invoice_candidate(combined)
                         if norm:
                             debug_info += f"ラベル近傍'{kw}'ブロック結合から検出: {combined} → {norm} (candidate扱い)"
                             return norm, debug_info, True  # 結合ロジックは常にcandidate扱い
-                    
-                    # 14桁を超えたら打ち切り
-                    if digit_count > 14:
-                        break
 
     # (3) 全文検索 (低信頼度 → needs_review=true)
-    all_candidates = re.findall(_T_NUMBER_PATTERN, ocr_text)
+    all_candidates = [ocr_text[s:e] for s, e in t_spans]
     if all_candidates:
         debug_info += f"全文候補{len(all_candidates)}件: {[c.strip() for c in all_candidates]}; "
-        for cand in all_candidates:
-            norm, norm_low = _normalize_invoice_candidate(cand)
-            if norm:
-                debug_info += f"全文検索から検出(要確認): {cand.strip()} → {norm}"
-                return norm, debug_info, True  # 全文検索 = 常に低信頼度
+        picked = _pick_invoice_candidate(all_candidates)
+        if picked:
+            cand, norm, _ = picked
+            debug_info += f"全文検索から検出(要確認): {cand.strip()} → {norm}"
+            return norm, debug_info, True  # 全文検索 = 常に低信頼度
 
     debug_info += "候補なし"
     return "", debug_info, False
@@ -297,8 +539,32 @@ def _extract_invoice_no_from_text(ocr_text: str, ai_raw: str = "") -> Tuple[str,
 
 # 日付ラベルキーワード
 _DATE_LABEL_KEYWORDS = ["日付", "利用日", "乗車日", "発行日", "領収日", "年月日"]
-
-
+_DATE_LABEL_RE = _build_label_regex(_DATE_LABEL_KEYWORDS)
+_DATE_LABEL_AC = _build_label_automaton(_DATE_LABEL_KEYWORDS)
+
+# 日付候補パターン (複数形式に対応)
+_DATE_PATTERNS = [
+    # YYYY/MM/DD or YYYY-MM-DD
+    (r"(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})", "slash"),
+    # YYYY年MM月DD日
+    (r"(\d{4})年(\d{1,2})月(\d{1,2})日", "kanji"),
+    # 令和X年MM月DD日 (令和元年=2019, 令和2年=2020, ...)
+    (r"令和\s*(\d{1,2})年(\d{1,2})月(\d{1,2})日", "reiwa"),
+    # 令和X年/MM/DD (混在形式)
+    (r"令和\s*(\d{1,2})年[/\-](\d{1,2})[/\-](\d{1,2})", "reiwa"),
+]
+
+# 全パターンを1つの正規表現にまとめ、OCR全文を1回の走査で探す
+# 各パターンは3グループ (年, 月, 日) なので、最後に一致したグループ番号 (3, 6, 9, 12) で形式が分かる
+_DATE_RE = re.compile("|".join(f"(?:{p})" for p, _ in _DATE_PATTERNS))
+_DATE_FORMAT_BY_LASTINDEX = {3 * (i + 1): fmt for i, (_, fmt) in enumerate(_DATE_PATTERNS)}
+
+# 日付候補の最高点 (ラベル近傍 +10, 現在年±2 +5)
+_DATE_MAX_SCORE = 15
+
+
+# _extract_invoice_no_from_text と同様に (OCR全文, AI値) 単位でキャッシュ
+@functools.lru_cache(maxsize=256)
 def _extract_best_date(ocr_text: str, ai_date: str = "") -> Tuple[str, str, bool]:
     """
     OCR全文テキストから日付候補を抽出し、スコアリングで最適な日付を決定。
@@ -316,60 +582,45 @@ def _extract_best_date(ocr_text: str, ai_date: str = "") -> Tuple[str, str, bool
 
     debug_info = ""
 
-    # 日付候補パターン (複数形式に対応)
-    date_patterns = [
-        # YYYY/MM/DD or YYYY-MM-DD
-        (r"(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})", "slash"),
-        # YYYY年MM月DD日
-        (r"(\d{4})年(\d{1,2})月(\d{1,2})日", "kanji"),
-        # 令和X年MM月DD日 (令和元年=2019, 令和2年=2020, ...)
-        (r"令和\s*(\d{1,2})年(\d{1,2})月(\d{1,2})日", "reiwa"),
-        # 令和X年/MM/DD (混在形式)
-        (r"令和\s*(\d{1,2})年[/\-](\d{1,2})[/\-](\d{1,2})", "reiwa"),
-    ]
-
     # 日付ラベルの位置をすべて特定
-    label_positions = []
-    for kw in _DATE_LABEL_KEYWORDS:
-        for m in re.finditer(re.escape(kw), ocr_text):
-            label_positions.append(m.end())
+    label_positions = [end for _, _, end in _find_labels(ocr_text, _DATE_LABEL_AC, _DATE_LABEL_RE, _DATE_LABEL_KEYWORDS)]
 
     candidates = []
 
-    for pattern, fmt in date_patterns:
-        for m in re.finditer(pattern, ocr_text):
-            if fmt == "reiwa":
-                # 令和年 → 西暦変換
-                reiwa_year = int(m.group(1))
-                year = 2018 + reiwa_year
-                month = int(m.group(2))
-                day = int(m.group(3))
-            else:
-                year = int(m.group(1))
-                month = int(m.group(2))
-                day = int(m.group(3))
-
-            # 基本的な日付バリデーション
-            if not (1 <= month <= 12 and 1 <= day <= 31 and 2000 <= year <= 2099):
-                continue
+    for m in _DATE_RE.finditer(ocr_text):
+        last = m.lastindex
+        fmt = _DATE_FORMAT_BY_LASTINDEX[last]
+        year, month, day = int(m.group(last - 2)), int(m.group(last - 1)), int(m.group(last))
+        if fmt == "reiwa":
+            # 令和年 → 西暦変換
+            year = 2018 + year
 
-            pos = m.start()
-            score = 0
+        # 基本的な日付バリデーション
+        if not (1 <= month <= 12 and 1 <= day <= 31 and 2000 <= year <= 2099):
+            continue
 
-            # スコア: 日付ラベル近傍ボーナス (ラベル直後30文字以内)
-            for lp in label_positions:
-                if 0 <= pos - lp <= 30:
-                    score += 10
-                    break
+        pos = m.start()
+        score = 0
+
+        # スコア: 日付ラベル近傍ボーナス (ラベル直後30文字以内)
+        for lp in label_positions:
+            if 0 <= pos - lp <= 30:
+                score += 10
+                break
+
+        # スコア: 年の妥当性
+        if CURRENT_YEAR - 2 <= year <= CURRENT_YEAR + 2:
+            score += 5
+        else:
+            score -= 5
 
-            # スコア: 年の妥当性
-            if CURRENT_YEAR - 2 <= year <= CURRENT_YEAR + 2:
-                score += 5
-            else:
-                score -= 5
+        date_str = f"{year:04d}/{month:02d}/{day:02d}"
+        candidates.append((date_str, score, year, pos))
 
-            date_str = f"{year:04d}/{month:02d}/{day:02d}"
-            candidates.append((date_str, score, year, pos))
+        # 最高点 (ラベル近傍 + 妥当な年) に達したら以降の候補は上回れない
+        # (走査は位置順なので、同点でも先に見つかったこれが選ばれる)
+        if score >= _DATE_MAX_SCORE:
+            break
 
     if not candidates:
         # OCRテキストから日付が見つからない → AI値を使用
@@ -407,27 +658,44 @@ def _extract_best_date(ocr_text: str, ai_date: str = "") -> Tuple[str, str, bool
 #  共通ユーティリティ
 # ═══════════════════════════════════════════════════════════
 
+# AIが返す文字列 → Enum の対応表 (呼び出しごとに作らないようモジュールレベルに置く)
+_TAX_RATE_MAP = {
+    "10": TaxRate.RATE_10,
+    "8": TaxRate.RATE_8,
+    "8_reduced": TaxRate.RATE_8_REDUCED,
+    "exempt": TaxRate.EXEMPT,
+}
+_PAYMENT_MAP = {
+    "cash": PaymentMethod.CASH,
+    "paypay": PaymentMethod.PAYPAY,
+    "credit": PaymentMethod.CREDIT,
+}
+
+
 def _map_tax_rate(rate_str: str) -> TaxRate:
     """文字列 → TaxRate Enum"""
-    mapping = {
-        "10": TaxRate.RATE_10,
-        "8": TaxRate.RATE_8,
-        "8_reduced": TaxRate.RATE_8_REDUCED,
-        "exempt": TaxRate.EXEMPT,
-    }
-    return mapping.get(rate_str, TaxRate.UNKNOWN)
+    return _TAX_RATE_MAP.get(rate_str, TaxRate.UNKNOWN)
 
 
 def _map_payment(clue: str) -> PaymentMethod:
     """手がかり文字列 → PaymentMethod Enum"""
-    clue_lower = clue.lower().strip()
-    if clue_lower == "cash":
-        return PaymentMethod.CASH
-    elif clue_lower == "paypay":
-        return PaymentMethod.PAYPAY
-    elif clue_lower == "credit":
-        return PaymentMethod.CREDIT
-    return PaymentMethod.UNKNOWN
+    return _PAYMENT_MAP.get(clue.lower().strip(), PaymentMethod.UNKNOWN)
+
+
+# missing_fields に入れる項目名 (analyze_receipt_image の判定ビット順)
+_MISSING_FIELD_NAMES = (
+    "date",
+    "vendor",
+    "total_amount",
+    "tax_rate",
+    "payment_method",
+    "date_year_out_of_range",
+    "invoice_no_candidate",
+)
+
+
+# マークダウンコードブロックの開始行 (```json など) と終了の ```
+_CODE_FENCE_RE = re.compile(r"^```[^\n]*\n?|\n?```\s*$")
 
 
 def _parse_response_text(raw_text: str) -> list:
@@ -436,15 +704,17 @@ def _parse_response_text(raw_text: str) -> list:
 
     # マークダウンコードブロックの除去
     if text.startswith("```"):
-        lines = text.split("\n")
-        lines = [l for l in lines if not l.startswith("```")]
-        text = "\n".join(lines)
+        text = _CODE_FENCE_RE.sub("", text)
 
     try:
-        extracted = json.loads(text)
+        try:
+            extracted = jsonutil.loads(text)
+        except ValueError:
+            # orjson が受け付けない表記 (NaN など) は標準jsonで再試行
+            extracted = json.loads(text)
     except json.JSONDecodeError as e:
-        print(f"[ERROR] AI応答のJSON解析失敗: {e}")
-        print(f"[DEBUG] 生テキスト: {text[:500]}")
+        logger.error("AI応答のJSON解析失敗: %s", e)
+        logger.debug("生テキスト: %.500s", text)
         return []
 
     if not isinstance(extracted, list):
@@ -457,57 +727,91 @@ def _parse_response_text(raw_text: str) -> list:
 #  APIコール
 # ═══════════════════════════════════════════════════════════
 
-def _call_gemini(image_path: str) -> str:
+# APIクライアントはプロセス内で使い回す (HTTPS接続の Keep-Alive を効かせる)
+# APIキーが変わった場合のみ作り直す
+_client_lock = threading.Lock()
+_gemini_client = None
+_openai_client = None
+
+
+def _get_gemini_client():
+    """Gemini クライアントを取得 (初回のみ生成)"""
+    global _gemini_client
+    api_key = os.getenv("GEMINI_API_KEY")
+    cached = _gemini_client
+    if cached is None or cached[0] != api_key:
+        with _client_lock:
+            cached = _gemini_client
+            if cached is None or cached[0] != api_key:
+                from google import genai
+                cached = _gemini_client = (api_key, genai.Client(api_key=api_key))
+    return cached[1]
+
+
+def _get_openai_client():
+    """OpenAI クライアントを取得 (初回のみ生成)"""
+    global _openai_client
+    api_key = os.getenv("OPENAI_API_KEY")
+    cached = _openai_client
+    if cached is None or cached[0] != api_key:
+        with _client_lock:
+            cached = _openai_client
+            if cached is None or cached[0] != api_key:
+                from openai import OpenAI
+                cached = _openai_client = (api_key, OpenAI(api_key=api_key))
+    return cached[1]
+
+
+def _call_gemini(image_path: ImageSource) -> str:
     """Gemini 2.0 Flash で画像を解析 (Retry on 429)"""
     return _call_gemini_impl(image_path)
 
 @RETRY_DECORATOR
-def _call_gemini_impl(image_path: str) -> str:
+def _call_gemini_impl(image_path: ImageSource) -> str:
     """Gemini 2.0 Flash で画像を解析"""
-    from google import genai
     from google.genai import types
 
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-    img = Image.open(image_path)
+    client = _get_gemini_client()
+    data, mime_type = _prepare_upload_image(image_path)
 
+    # 固定のプロンプトは system_instruction として先頭に置き、毎回同じ接頭辞にする
+    # (プロンプトキャッシュ対象になり、入力トークン課金と応答待ちが減る)
     response = client.models.generate_content(
         model=GEMINI_MODEL,
-        contents=[EXTRACTION_PROMPT, img],
-        config=types.GenerateContentConfig(temperature=0.1),
+        contents=[types.Part.from_bytes(data=data, mime_type=mime_type)],
+        config=types.GenerateContentConfig(system_instruction=EXTRACTION_PROMPT, temperature=0.1),
     )
     return response.text
 
 
-def _call_openai(image_path: str) -> str:
+def _call_openai(image_path: ImageSource) -> str:
     """OpenAI GPT-4o で画像を解析 (Retry on 429)"""
-    return _call_openai_impl(image_path)
+    # 画像の縮小・base64変換はリトライの外で1回だけ行う
+    data, mime_type = _prepare_upload_image(image_path)
+    image_url = f"data:{mime_type};base64,{_b64.b64encode(data).decode('ascii')}"
+    del data
+    return _call_openai_impl(image_url)
 
 @RETRY_DECORATOR
-def _call_openai_impl(image_path: str) -> str:
-    """OpenAI GPT-4o で画像を解析"""
-    from openai import OpenAI
-
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    b64 = _image_to_base64(image_path)
-
-    # 画像の拡張子からmime type推定
-    ext = os.path.splitext(image_path)[1].lower()
-    mime_map = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
-    mime_type = mime_map.get(ext, "image/png")
+def _call_openai_impl(image_url: str) -> str:
+    """OpenAI GPT-4o で画像 (data URL) を解析"""
+    client = _get_openai_client()
 
+    # 固定のプロンプトは system メッセージとして先頭に置き、毎回同じ接頭辞にする
+    # (OpenAI のプロンプトキャッシュは先頭一致で自動適用される)
     response = client.chat.completions.create(
         model=OPENAI_MODEL,
         messages=[
+            {"role": "system", "content": EXTRACTION_PROMPT},
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": EXTRACTION_PROMPT},
                     {
                         "type": "image_url",
-                        "image_url": {"url": f"data:{mime_type};base64,{b64}"},
+                        "image_url": {"url": image_url},
                     },
                 ],
-            }
+            },
         ],
         temperature=0.1,
     )
@@ -518,9 +822,9 @@ def _call_openai_impl(image_path: str) -> str:
 #  メイン処理
 # ═══════════════════════════════════════════════════════════
 
-def analyze_receipt_image(image_path: str, use_split_scan: bool = False) -> List[ReceiptRecord]:
+def analyze_receipt_image(image_path: ImageSource, use_split_scan: bool = False) -> List[ReceiptRecord]:
     """
-    画像ファイルパスを受け取り、OCR → ReceiptRecord リストを返す。
+    画像ファイルパス (またはメモリ上のバイト列) を受け取り、OCR → ReceiptRecord リストを返す。
     Gemini → 失敗時 OpenAI にフォールバック。
 
     後処理:
@@ -536,20 +840,31 @@ def analyze_receipt_image(image_path: str, use_split_scan: bool = False) -> List
     return AnalysisResult(records, ["Single scan performed. No merge needed."], raw_records=records)
 
 
-def _analyze_single_image(image_path: str, offset_info: Optional[tuple] = None) -> List[ReceiptRecord]:
+# 詳細スキャンの同時実行数 (全体1枚 + クロップ5枚を一度に投げる)
+_SPLIT_SCAN_CONCURRENCY = 6
+
+
+def _analyze_single_image(image_path: ImageSource, offset_info: Optional[tuple] = None) -> List[ReceiptRecord]:
     """単一画像の解析 (オフセット情報があれば座標変換を行う)"""
     raw_text = None
     backend_used = None
 
+    # (0) 同じ画像を解析済みならキャッシュした応答を使う (キャッシュ無効時は画像のハッシュも取らない)
+    cache_key = _response_cache_key(image_path) if _LLM_CACHE_DIR else None
+    cached = _load_cached_response(cache_key) if cache_key else None
+    if cached is not None:
+        logger.info("キャッシュ済みの応答を使用します (%s)", _source_name(image_path))
+        raw_text, backend_used = cached
+
     # (1) Gemini を試す
     gemini_key = os.getenv("GEMINI_API_KEY")
-    if gemini_key:
+    if raw_text is None and gemini_key:
         try:
-            print(f"[INFO] Gemini 2.0 Flash で解析を試みます... ({os.path.basename(image_path)})")
+            logger.info("Gemini 2.0 Flash で解析を試みます... (%s)", _source_name(image_path))
             raw_text = _call_gemini(image_path)
             backend_used = "Gemini"
         except Exception as e:
-            print(f"[WARN] Gemini 失敗: {e}")
+            logger.warning("Gemini 失敗: %s", e)
             raw_text = None
 
     # (2) OpenAI にフォールバック
@@ -557,20 +872,22 @@ def _analyze_single_image(image_path: str, offset_info: Optional[tuple] = None)
         openai_key = os.getenv("OPENAI_API_KEY")
         if openai_key:
             try:
-                print("[INFO] OpenAI GPT-4o にフォールバックします...")
+                logger.info("OpenAI GPT-4o にフォールバックします...")
                 raw_text = _call_openai(image_path)
                 backend_used = "gpt-4o"
             except Exception as e:
-                print(f"[ERROR] OpenAI も失敗: {e}")
+                logger.error("OpenAI も失敗: %s", e)
                 return []
         else:
-            print("[ERROR] 利用可能なAPIキーがありません")
+            logger.error("利用可能なAPIキーがありません")
             return []
 
     # レスポンスをパース
     extracted = _parse_response_text(raw_text)
     if not extracted:
         return []
+    if cache_key and cached is None:
+        _store_cached_response(cache_key, raw_text, backend_used)
 
     # ReceiptRecord に変換 (後処理付き)
     records: List[ReceiptRecord] = []
@@ -585,44 +902,33 @@ def _analyze_single_image(image_path: str, offset_info: Optional[tuple] = None)
         # ── 日付 候補スコアリング ──
         ai_date = item.get("date", "")
         best_date, date_debug, date_needs_review = _extract_best_date(ocr_text, ai_date)
+        logger.debug("[T番号] %s: %s", vendor, invoice_debug)
+        logger.debug("[日付] %s: %s", vendor, date_debug)
         
         # ── 基本マッピング ──
         tax_rate = _map_tax_rate(item.get("tax_rate", "unknown"))
         payment = _map_payment(item.get("payment_clues", "unknown"))
 
         # ── needs_review / missing_fields 判定 ──
-        needs_review = False
-        missing = []
-
-        if not best_date:
-            missing.append("date")
-            needs_review = True
-        if not vendor or vendor == "?":
-            missing.append("vendor")
-            needs_review = True
-        if not item.get("total_amount") or item.get("total_amount", 0) == 0:
-            missing.append("total_amount")
-            needs_review = True
-        if tax_rate == TaxRate.UNKNOWN:
-            missing.append("tax_rate")
-            needs_review = True
-        if payment == PaymentMethod.UNKNOWN:
-            missing.append("payment_method")
-            needs_review = True
-
-        # 日付年が範囲外 → 要確認
-        if date_needs_review:
-            needs_review = True
-            if "date_year_out_of_range" not in missing:
-                missing.append("date_year_out_of_range")
-
-        # T番号が低信頼度で検出された場合
+        # 不足項目をビットで集計し、1つでも立っていれば要確認 (リストは該当時のみ作る)
+        missing_bits = (
+            (not best_date)
+            | (not vendor or vendor == "?") << 1
+            | (not item.get("total_amount")) << 2
+            | (tax_rate == TaxRate.UNKNOWN) << 3
+            | (payment == PaymentMethod.UNKNOWN) << 4
+            | bool(date_needs_review) << 5  # 日付年が範囲外
+            | bool(invoice_low_conf) << 6  # T番号が低信頼度で検出された
+        )
+        needs_review = missing_bits != 0
+        missing = (
+            [name for i, name in enumerate(_MISSING_FIELD_NAMES) if missing_bits >> i & 1]
+            if needs_review else []
+        )
+
         if invoice_low_conf:
             invoice_confirmed = ""
             invoice_candidate = invoice_norm
-            needs_review = True
-            if "invoice_no_candidate" not in missing:
-                missing.append("invoice_no_candidate")
         else:
             invoice_confirmed = invoice_norm
             invoice_candidate = ""
@@ -684,46 +990,36 @@ def _analyze_single_image(image_path: str, offset_info: Optional[tuple] = None)
     return records
 
 
-import concurrent.futures
-
-def _analyze_receipt_image_split(image_path: str) -> List[ReceiptRecord]:
+def _analyze_receipt_image_split(image_path: ImageSource) -> List[ReceiptRecord]:
     """詳細スキャン（4分割+中央）を実行して結果をマージ"""
-    print("[INFO] 詳細スキャン(Split Scan)を開始します...")
-    
-    # 1. 全体スキャン
-    print("[INFO] Step 1: 全体スキャン")
-    all_records = _analyze_single_image(image_path)
-    
-    # 2. 分割スキャン (並列実行)
-    splits = _split_image(image_path)
-    print(f"[INFO] Step 2: 分割スキャン開始 (計{len(splits)}枚, 並列実行)")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        future_to_split = {
-            executor.submit(_analyze_single_image, path, offset): path
-            for path, offset in splits
-        }
-        
-        for future in concurrent.futures.as_completed(future_to_split):
-            path = future_to_split[future]
+    logger.info("詳細スキャン(Split Scan)を開始します...")
+
+    # 全体スキャンと分割スキャンはどれもAPIの応答待ちなので、同じスレッドプールで同時に投げる
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_SPLIT_SCAN_CONCURRENCY) as executor:
+        # 1. 全体スキャン (応答待ちの間にクロップを作る)
+        logger.info("Step 1: 全体スキャン")
+        full_future = executor.submit(_analyze_single_image, image_path)
+
+        # 2. 分割スキャン
+        splits = _split_image(image_path)
+        logger.info("Step 2: 分割スキャン開始 (計%d枚, 並列実行)", len(splits))
+        split_futures = [
+            executor.submit(_analyze_single_image, crop_data, offset)
+            for crop_data, offset in splits
+        ]
+
+        all_records = full_future.result()
+        for i, future in enumerate(split_futures):
             try:
-                records = future.result()
-                all_records.extend(records)
-                print(f"[INFO] Split scan finished for {os.path.basename(path)}")
+                all_records.extend(future.result())
+                logger.info("Split scan finished for crop_%d", i)
             except Exception as e:
-                print(f"[ERROR] Split scan failed for {os.path.basename(path)}: {e}")
-            finally:
-                # ファイル削除
-                if os.path.exists(path):
-                    os.remove(path)
+                logger.error("Split scan failed for crop_%d: %s", i, e)
 
     # 3. マージ（重複排除）
     return _merge_records(all_records)
 
 
-import hashlib
-from collections import defaultdict
-
 class AnalysisResult(list):
     """リスト互換の解析結果クラス (ログ情報とRawデータを保持)"""
     def __init__(self, iterable=None, logs=None, raw_records=None):
@@ -731,6 +1027,10 @@ class AnalysisResult(list):
         self.logs = logs or []
         self.raw_records = raw_records or []
 
+_NORMALIZE_STRIP_RE = re.compile(r"[^0-9a-z\u3040-\u309f\u30a0-\u30ff\u4e00-\u9faf]")
+
+# 同じ店名・摘要が重複レコード間で何度も出るので結果をキャッシュ
+@functools.lru_cache(maxsize=4096)
 def _normalize_text(text: str) -> str:
     """ゆらぎ吸収用のテキスト正規化"""
     if not text:
@@ -738,14 +1038,7 @@ def _normalize_text(text: str) -> str:
     # NFKC正規化 & 小文字化
     norm = unicodedata.normalize("NFKC", text).lower()
     # 英数字と日本語のみ残す (記号除去)
-    return re.sub(r"[^0-9a-z\u3040-\u309f\u30a0-\u30ff\u4e00-\u9faf]", "", norm)
-
-def _fingerprint_text(text: str) -> str:
-    """テキストのフィンガープリント(ハッシュ)生成"""
-    norm = _normalize_text(text)
-    if not norm:
-        return ""
-    return hashlib.md5(norm.encode("utf-8")).hexdigest()
+    return _NORMALIZE_STRIP_RE.sub("", norm)
 
 def _calculate_score(rec: ReceiptRecord) -> int:
     """代表レコード選定用のスコア算出"""
@@ -791,6 +1084,10 @@ def _merge_records(records: List[ReceiptRecord]) -> AnalysisResult:
     # 未割り当てのレコードインデックス
     remaining_indices = set(range(len(records)))
 
+    # 店名・品目の正規化は各戦略で使うので、レコード順の配列として先に1回だけ作る
+    vendor_norms = [_normalize_text(rec.vendor) for rec in records]
+    subject_norms = [_normalize_text(rec.subject) for rec in records]
+
 
 
     # Strategy tracking
@@ -798,31 +1095,33 @@ def _merge_records(records: List[ReceiptRecord]) -> AnalysisResult:
     group_reasons = {}
 
     # 戦略4 (Fuzzy): (日付, 金額) が一致し、店名が部分一致 or 片方不明
-    candidates = sorted(list(remaining_indices))
-    skipped_in_fuzzy = set()
-    
-    for idx_i in range(len(candidates)):
-        i = candidates[idx_i]
-        if i in skipped_in_fuzzy:
-            continue
-            
-        rec1 = records[i]
-        # 日付と金額は必須 (これらが違うなら別人とする)
-        if not (rec1.date and rec1.total_amount > 0):
+    # 日付と金額は必須 (これらが違うなら別人とする) なので、先に (日付, 金額) でバケット分けして
+    # 店名の比較は同じバケット内だけで行う
+    buckets = defaultdict(list)
+    for i in sorted(remaining_indices):
+        rec = records[i]
+        if rec.date and rec.total_amount > 0:
+            buckets[(rec.date, rec.total_amount)].append(i)
+
+    fuzzy_groups = []
+    for members in buckets.values():
+        if len(members) < 2:
             continue
-            
-        group_members = [i]
-        v1 = _normalize_text(rec1.vendor)
-        
-        for idx_j in range(idx_i + 1, len(candidates)):
-            j = candidates[idx_j]
-            if j in skipped_in_fuzzy:
+        vendors = [vendor_norms[i] for i in members]
+        skipped_in_fuzzy = set()
+
+        for idx_i, i in enumerate(members):
+            if idx_i in skipped_in_fuzzy:
                 continue
-                
-            rec2 = records[j]
-            if rec1.date == rec2.date and rec1.total_amount == rec2.total_amount:
-                v2 = _normalize_text(rec2.vendor)
-                
+
+            group_members = [i]
+            v1 = vendors[idx_i]
+
+            for idx_j in range(idx_i + 1, len(members)):
+                if idx_j in skipped_in_fuzzy:
+                    continue
+                v2 = vendors[idx_j]
+
                 # 店名マッチ判定
                 match = False
                 if v1 == v2:
@@ -833,26 +1132,31 @@ def _merge_records(records: List[ReceiptRecord]) -> AnalysisResult:
                 elif v1 in v2 or v2 in v1:
                      # 部分一致 (例: "seven" in "seveneleven")
                     match = True
-                
+
                 if match:
-                    group_members.append(j)
-                    skipped_in_fuzzy.add(j)
-        
-        if len(group_members) > 1:
-            # Fuzzyグループ成立
-            gid = f"fuzzy_{i}"
-            group_reasons[gid] = "Fuzzy Match (Date/Amount + Vendor)"
-            for member_idx in group_members:
-                groups[gid].append(records[member_idx])
-                remaining_indices.discard(member_idx)
-            skipped_in_fuzzy.add(i) # 自分自身もskip
+                    group_members.append(members[idx_j])
+                    skipped_in_fuzzy.add(idx_j)
+
+            if len(group_members) > 1:
+                fuzzy_groups.append(group_members)
+                skipped_in_fuzzy.add(idx_i) # 自分自身もskip
+
+    # グループの並びはバケット分け前と同じ (先頭レコードの順)
+    fuzzy_groups.sort(key=lambda group_members: group_members[0])
+    for group_members in fuzzy_groups:
+        # Fuzzyグループ成立
+        gid = f"fuzzy_{group_members[0]}"
+        group_reasons[gid] = "Fuzzy Match (Date/Amount + Vendor)"
+        for member_idx in group_members:
+            groups[gid].append(records[member_idx])
+            remaining_indices.discard(member_idx)
 
     # 戦略2: (日付, 金額, 品目) - 店名がゆらいでいる場合 (Fuzzyで救えなかった場合)
     key_map_2 = defaultdict(list)
     for i in list(remaining_indices):
         rec = records[i]
         if rec.date and rec.total_amount > 0:
-            subj_norm = _normalize_text(rec.subject)
+            subj_norm = subject_norms[i]
             if subj_norm:
                 key = (rec.date, rec.total_amount, subj_norm)
                 key_map_2[key].append(i)
@@ -870,8 +1174,7 @@ def _merge_records(records: List[ReceiptRecord]) -> AnalysisResult:
     for i in list(remaining_indices):
         rec = records[i]
         if rec.total_amount > 0 and rec.vendor and rec.vendor != "?":
-             subj_norm = _normalize_text(rec.subject)
-             key = (rec.total_amount, _normalize_text(rec.vendor), subj_norm)
+             key = (rec.total_amount, vendor_norms[i], subject_norms[i])
              key_map_3[key].append(i)
              
     for key, indices in key_map_3.items():
@@ -894,12 +1197,14 @@ def _merge_records(records: List[ReceiptRecord]) -> AnalysisResult:
             merged_results.append(group_recs[0])
             continue
             
-        # スコアリングで代表決定
-        best_rec = max(group_recs, key=_calculate_score)
+        # スコアリングで代表決定 (スコアは各レコード1回だけ計算し、ログでも使い回す)
+        scores = [_calculate_score(r) for r in group_recs]
+        best_pos = max(range(len(group_recs)), key=scores.__getitem__)
+        best_rec = group_recs[best_pos]
         
         # ログ記録
         others_count = len(group_recs) - 1
-        logs.append(f"グループ統合({others_count+1}件): 代表='{best_rec.vendor}' ({best_rec.date}, ¥{best_rec.total_amount}) Score={_calculate_score(best_rec)}")
+        logs.append(f"グループ統合({others_count+1}件): 代表='{best_rec.vendor}' ({best_rec.date}, ¥{best_rec.total_amount}) Score={scores[best_pos]}")
         
         # マージ処理: needs_review の OR条件、不足情報の補完
         # T番号は確定情報があればそれを優先
@@ -939,7 +1244,8 @@ def _merge_records(records: List[ReceiptRecord]) -> AnalysisResult:
 
     n_after = len(merged_results)
     logs.append(f"マージ完了: {n_before}件 → {n_after}件")
-    print("\n".join(logs))
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s", "\n".join(logs))
     
     return AnalysisResult(merged_results, logs, raw_records=records)
 
@@ -0,0 +1,27 @@
+"""
+JSON の読み書き
+- orjson があれば高速なそちらを使い、なければ標準 json にフォールバック
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """JSON (str / bytes) をパースする。不正な入力は ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """UTF-8 の JSON バイト列にする (非ASCIIはそのまま、indent=True でインデント2)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
@@ -1,5 +1,5 @@
 import os
-import json
+import operator
 import uuid
 from pathlib import Path
 from datetime import datetime
@@ -9,7 +9,7 @@ import streamlit as st
 # 相対インポートではなく絶対インポートを使用
 try:
     from logic.models import ReceiptRecord, TaxRate, PaymentMethod, Category
-    from logic import data_layer
+    from logic import data_layer, jsonutil
 except ImportError:
     # app.pyからロードされた場合、logicがsys.modulesにあるはず
     import sys
@@ -20,6 +20,8 @@ except ImportError:
         Category = sys.modules["logic.models"].Category
     if "logic.data_layer" in sys.modules:
         data_layer = sys.modules["logic.data_layer"]
+    if "logic.jsonutil" in sys.modules:
+        jsonutil = sys.modules["logic.jsonutil"]
 
 # 定数
 BASE_OUTPUT_DIR = Path("output")
@@ -27,6 +29,63 @@ INPUT_DIR = Path("input/inbox")
 DONE_DIR = Path("input/done")
 FAILED_DIR = Path("input/failed")
 
+def _read_json(path) -> dict:
+    """JSONファイルを読み込む (orjson優先)"""
+    with open(path, "rb") as f:
+        return jsonutil.loads(f.read())
+
+
+def _write_json(path, data: dict):
+    """JSONファイルを書き出す (orjson優先, インデント2・非ASCIIそのまま)
+
+    一時ファイルに書いてから os.replace で差し替えるため、
+    書き込み途中で落ちても元のファイルは壊れない。
+    """
+    payload = jsonutil.dumps(data, indent=True)
+
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# 編集ログ (1件ごとの編集を追記) がこのサイズを超えたら summary.json に反映する
+_WAL_COMPACT_BYTES = 256 * 1024
+
+
+def _wal_path(summary_path) -> str:
+    return data_layer.summary_wal_path(summary_path)
+
+
+def _compact_wal(summary_path):
+    """編集ログを summary.json に反映して削除する (ログがなければ何もしない)"""
+    if not os.path.exists(_wal_path(summary_path)):
+        return
+    data = _read_json(summary_path)
+    data_layer.replay_summary_wal(summary_path, data)
+    _write_json(summary_path, data)
+    # 書き込み後に削除するため、途中で落ちても再適用は冪等
+    os.remove(_wal_path(summary_path))
+
+
+# save_records で書き出す属性 (attrgetter でまとめて取得)
+_record_fields = operator.attrgetter(
+    "date", "vendor", "subject", "total_amount", "tax_rate_detected", "payment_method",
+    "invoice_no_norm", "invoice_candidate", "category", "needs_review", "missing_fields",
+    "region", "merge_candidates", "merge_reason", "group_id", "is_confirmed",
+    "backend_used", "is_discarded", "image_path",
+)
+
+
 def get_current_session_dir():
     if "current_session_dir" in st.session_state:
         return Path(st.session_state.current_session_dir)
@@ -35,65 +94,62 @@ def get_current_session_dir():
 def find_sessions(use_cloud: bool) -> list[dict]:
     """output/ 配下の summary.json を探索し、セッション一覧を返す（クラウドモード対応）"""
     if use_cloud:
-        # クラウドモード: Turso DBからセッション一覧を取得
-        # data_layerは遅延インポートされている可能性があるため、ここで取得トライ
-        if 'logic.data_layer' not in locals():
-             import sys
-             if "logic.data_layer" in sys.modules:
-                dl = sys.modules["logic.data_layer"]
-             else:
-                # Fallback: app.py経由でなければ使えない可能性があるが、
-                # app.pyで初期化済みであることを期待
-                from logic import data_layer as dl
-        else:
-             dl = data_layer
-
-        db_sessions = dl.list_sessions()
-        sessions = []
-        for s in db_sessions:
-            sessions.append({
-                "dir": s.get("id", ""),
-                "file": "",
-                "total": 0,  # TODO: レシート数を取得
-                "valid": 0,
-                "invalid": 0,
-                "path": s.get("id", ""),  # クラウドではセッションIDをパスとして使用
-                "timestamp": s.get("created_at", ""),
-                "is_cloud": True,
-            })
-        return sessions
-    
-    # ローカルモード: ファイルベース
-    sessions = []
-    # glob して、フォルダ名でソート(降順)
+        # クラウドモード: キャッシュは data_layer 側 (書き込み時に破棄される)
+        return _find_cloud_sessions()
+
+    # ローカルモード: フォルダのmtimeをキーにキャッシュ
+    # (セッションの作成・削除でフォルダのmtimeが変わり自動的に無効化される)
     if not BASE_OUTPUT_DIR.exists():
         BASE_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-        
-    all_dirs = sorted(list(BASE_OUTPUT_DIR.glob("*")), reverse=True)
-    
-    for d in all_dirs:
-        if not d.is_dir(): continue
-        summary_path = d / "summary.json"
-        if not summary_path.exists(): continue
-        
-        try:
-            with open(summary_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            sessions.append({
-                "dir": d.name,
-                "file": data.get("file", ""),
-                "total": data.get("total_receipts", 0),
-                "valid": data.get("valid_count", 0),
-                "invalid": data.get("invalid_count", 0),
-                "path": str(summary_path),
-                "timestamp": data.get("timestamp", ""),
-                "is_cloud": False,
-            })
-        except Exception:
-            pass
+    sig = (os.stat(BASE_OUTPUT_DIR).st_mtime_ns,)
+    return _find_local_sessions(str(BASE_OUTPUT_DIR), sig)
+
+
+def _find_cloud_sessions() -> list[dict]:
+    """Turso DBからセッション一覧を取得"""
+    # data_layerは遅延インポートされている可能性があるため、ここで取得トライ
+    import sys
+    if "logic.data_layer" in sys.modules:
+        dl = sys.modules["logic.data_layer"]
+    else:
+        # Fallback: app.py経由でなければ使えない可能性があるが、
+        # app.pyで初期化済みであることを期待
+        from logic import data_layer as dl
+
+    db_sessions = dl.list_sessions()
+    sessions = []
+    for s in db_sessions:
+        sessions.append({
+            "dir": s.get("id", ""),
+            "file": "",
+            "total": 0,  # TODO: レシート数を取得
+            "valid": 0,
+            "invalid": 0,
+            "path": s.get("id", ""),  # クラウドではセッションIDをパスとして使用
+            "timestamp": s.get("created_at", ""),
+            "is_cloud": True,
+        })
     return sessions
 
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _find_local_sessions(base_dir: str, sig: tuple) -> list[dict]:
+    """base_dir 配下のセッション一覧を読み込む (sig はキャッシュキー用)"""
+    return [
+        {
+            "dir": name,
+            "file": data.get("file", ""),
+            "total": data.get("total_receipts", 0),
+            "valid": data.get("valid_count", 0),
+            "invalid": data.get("invalid_count", 0),
+            "path": summary_path,
+            "timestamp": data.get("timestamp", ""),
+            "is_cloud": False,
+        }
+        for name, summary_path, data in data_layer.iter_local_summaries(base_dir)
+    ]
+
+
 def load_records(summary_path: str, use_cloud: bool) -> tuple[list, dict]:
     """summary.json からレコードリストを読み込む（クラウドモード対応）"""
     
@@ -140,46 +196,95 @@ def load_records(summary_path: str, use_cloud: bool) -> tuple[list, dict]:
         data = {"session_id": session_id, "records": [], "is_cloud": True}
         return records, data
     
-    # ローカルモード: ファイルベース
-    with open(summary_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    records = []
-    for r in data.get("records", []):
-        rec = ReceiptRecord(
-            date=r.get("date", ""),
-            vendor=r.get("vendor", ""),
-            subject=r.get("subject", ""),
-            total_amount=r.get("total_amount", 0),
-            invoice_no_norm=r.get("invoice_no", ""),
-            invoice_candidate=r.get("invoice_candidate", ""),
-            qualified_flag="○" if r.get("invoice_no", "") else "",
-            tax_rate_detected=TaxRate(r.get("tax_rate", "unknown")),
-            payment_method=PaymentMethod(r.get("payment_method", "unknown")),
-            category=Category(r.get("category", "unknown")),
-            needs_review=r.get("needs_review", True),
-            missing_fields=r.get("missing_fields", []),
-            region=r.get("region", None),
-            # Merge Info
-            merge_candidates=r.get("merge_candidates", []),
-            merge_reason=r.get("merge_reason", ""),
-            group_id=r.get("group_id", ""),
-            # Confirm
-            is_confirmed=r.get("is_confirmed", False),
-            
-            # Backend
-            backend_used=r.get("backend_used", ""),
-            
-            # Phase 10: Soft Delete
-            is_discarded=r.get("is_discarded", False),
-            
-            # Image Path
-            image_path=r.get("image_path", ""),
-        )
-        records.append(rec)
+    # ローカルモード: 前回の編集ログが残っていれば summary.json に反映してから読む
+    _compact_wal(summary_path)
+    # mtime+サイズをキーにキャッシュ
+    st_ = os.stat(summary_path)
+    return _load_local_records(str(summary_path), (st_.st_mtime_ns, st_.st_size))
+
+
+# summary.json のキー → ReceiptRecord のフィールド, デフォルト値
+# (可変デフォルトは共有を避けるためタプルで持ち、モデル側でリストに変換される)
+_SUMMARY_FIELDS = (
+    ("date", "date", ""),
+    ("vendor", "vendor", ""),
+    ("subject", "subject", ""),
+    ("total_amount", "total_amount", 0),
+    ("invoice_no", "invoice_no_norm", ""),
+    ("invoice_candidate", "invoice_candidate", ""),
+    ("needs_review", "needs_review", True),
+    ("missing_fields", "missing_fields", ()),
+    ("region", "region", None),
+    # Merge Info
+    ("merge_candidates", "merge_candidates", ()),
+    ("merge_reason", "merge_reason", ""),
+    ("group_id", "group_id", ""),
+    # Confirm
+    ("is_confirmed", "is_confirmed", False),
+    # Backend
+    ("backend_used", "backend_used", ""),
+    # Phase 10: Soft Delete
+    ("is_discarded", "is_discarded", False),
+    # Image Path
+    ("image_path", "image_path", ""),
+)
+
+# Enum に変換するフィールド (未設定時は "unknown")
+_SUMMARY_ENUM_FIELDS = (
+    ("tax_rate", "tax_rate_detected", TaxRate),
+    ("payment_method", "payment_method", PaymentMethod),
+    ("category", "category", Category),
+)
+
+
+def _record_from_summary(r: dict) -> ReceiptRecord:
+    """summary.json の1件を ReceiptRecord に変換"""
+    get = r.get
+    kwargs = {field: get(key, default) for key, field, default in _SUMMARY_FIELDS}
+    for key, field, enum_cls in _SUMMARY_ENUM_FIELDS:
+        kwargs[field] = enum_cls(get(key, "unknown"))
+    kwargs["qualified_flag"] = "○" if kwargs["invoice_no_norm"] else ""
+    return ReceiptRecord(**kwargs)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _load_local_records(summary_path: str, sig: tuple) -> tuple[list, dict]:
+    """summary.json を読み込んでレコード化 (sig はキャッシュキー用)"""
+    data = _read_json(summary_path)
+
+    records = [_record_from_summary(r) for r in data.get("records", [])]
     return records, data
 
 
+def _serialize_record(rec) -> dict:
+    """ReceiptRecord を summary.json の1件 (dict) に変換"""
+    (date, vendor, subject, total_amount, tax_rate, payment_method,
+     invoice_no, invoice_candidate, category, needs_review, missing_fields,
+     region, merge_candidates, merge_reason, group_id, is_confirmed,
+     backend_used, is_discarded, image_path) = _record_fields(rec)
+    return {
+        "date": date,
+        "vendor": vendor,
+        "subject": subject,
+        "total_amount": total_amount,
+        "tax_rate": tax_rate.value,
+        "payment_method": payment_method.value,
+        "invoice_no": invoice_no,
+        "invoice_candidate": invoice_candidate,
+        "category": category.value,
+        "needs_review": needs_review,
+        "missing_fields": missing_fields,
+        "region": region,
+        "merge_candidates": merge_candidates,
+        "merge_reason": merge_reason,
+        "group_id": group_id,
+        "is_confirmed": is_confirmed,
+        "backend_used": backend_used,
+        "is_discarded": is_discarded,
+        "image_path": image_path,
+    }
+
+
 def save_records(summary_path: str, records: list, original_data: dict, use_cloud: bool):
     """レコードリストを summary.json に書き戻す（クラウドモード対応）"""
     
@@ -193,6 +298,8 @@ def save_records(summary_path: str, records: list, original_data: dict, use_clou
         # クラウドモード: summary_pathはセッションID
         session_id = summary_path if isinstance(summary_path, str) and not summary_path.endswith(".json") else original_data.get("session_id", "")
         
+        # 全レコードを1回のリクエスト (1トランザクション) でまとめて保存
+        receipt_list = []
         for rec in records:
             receipt_data = {
                 "payee": rec.vendor,
@@ -209,55 +316,73 @@ def save_records(summary_path: str, records: list, original_data: dict, use_clou
                 "is_discarded": rec.is_discarded,
             }
             
-            # 既存レコードの更新 or 新規作成
+            # 既存レコードは id 付き (更新)、それ以外は新規作成
             if hasattr(rec, "_cloud_id") and rec._cloud_id:
                 receipt_data["id"] = rec._cloud_id
-                dl.update_receipt(rec._cloud_id, receipt_data)
-            else:
-                dl.save_receipt(session_id, receipt_data)
+            receipt_list.append(receipt_data)
+
+        # 1件でも失敗すると DatabaseError (全件ロールバック)。その場合IDは記録しない
+        # (記録すると次回は存在しない行への UPDATE になり、レコードが失われる)
+        receipt_ids = dl.batch_upsert_receipts(session_id, receipt_list)
+        # コミット成功後に新規作成分のIDを記録 (次回保存時の重複作成を防ぐ)
+        for rec, receipt_id in zip(records, receipt_ids):
+            rec._cloud_id = receipt_id
         return
     
     # ローカルモード: ファイルベース
-    serialized = []
+    # シリアライズと Valid カウントを1回のループで行う
+    serialized = [None] * len(records)
     valid_count = 0
-    invalid_count = 0
-    for rec in records:
-        entry = {
-            "date": rec.date,
-            "vendor": rec.vendor,
-            "subject": rec.subject,
-            "total_amount": rec.total_amount,
-            "tax_rate": rec.tax_rate_detected.value,
-            "payment_method": rec.payment_method.value,
-            "invoice_no": rec.invoice_no_norm,
-            "invoice_candidate": rec.invoice_candidate,
-            "category": rec.category.value,
-            "needs_review": rec.needs_review,
-            "missing_fields": rec.missing_fields,
-            "region": rec.region,
-            "merge_candidates": rec.merge_candidates,
-            "merge_reason": rec.merge_reason,
-            "group_id": rec.group_id,
-            "is_confirmed": rec.is_confirmed,
-            "backend_used": rec.backend_used,
-            "is_discarded": rec.is_discarded,
-            "image_path": rec.image_path,
-        }
-        serialized.append(entry)
-        
-        # Valid カウント
-        if not rec.is_discarded:
-             if not rec.missing_fields and not rec.needs_review: #Simplified logic
-                  pass
-
-        if not rec.is_discarded and not rec.missing_fields:
+    for i, rec in enumerate(records):
+        d = serialized[i] = _serialize_record(rec)
+        if not d["is_discarded"] and not d["missing_fields"]:
             valid_count += 1
-        else:
-            invalid_count += 1
+    invalid_count = len(serialized) - valid_count
 
     original_data["records"] = serialized
     original_data["valid_count"] = valid_count
     original_data["invalid_count"] = invalid_count
 
-    with open(summary_path, "w", encoding="utf-8") as f:
-        json.dump(original_data, f, ensure_ascii=False, indent=2)
+    _write_json(summary_path, original_data)
+    # 全件を書き戻したので編集ログは不要 (書き込み後に削除するため、途中で落ちても再適用は冪等)
+    try:
+        os.remove(_wal_path(summary_path))
+    except FileNotFoundError:
+        pass
+    # 件数が変わるためセッション一覧のキャッシュを破棄
+    _find_local_sessions.clear()
+
+
+def save_record_edit(summary_path: str, records: list, idx: int, original_data: dict, use_cloud: bool):
+    """
+    1件だけ編集したレコードを保存する。
+    ローカルでは summary.json 全体を書き直さず、編集ログ (summary.json.wal) に1行追記する。
+    ログには最新の valid/invalid 件数も書き、セッション一覧はそれを読む。
+    ログが大きくなったとき・次にセッションを読み込んだときに summary.json に反映 (コンパクション)。
+    """
+    if use_cloud:
+        # クラウドは対象レコードのみ upsert
+        save_records(summary_path, [records[idx]], original_data, use_cloud)
+        return
+
+    valid_count = sum(1 for rec in records if not rec.is_discarded and not rec.missing_fields)
+    line = {
+        "idx": idx,
+        "record": _serialize_record(records[idx]),
+        "valid_count": valid_count,
+        "invalid_count": len(records) - valid_count,
+    }
+    payload = jsonutil.dumps(line) + b"\n"
+
+    wal_path = _wal_path(summary_path)
+    with open(wal_path, "ab") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        wal_size = f.tell()
+
+    if wal_size > _WAL_COMPACT_BYTES:
+        save_records(summary_path, records, original_data, use_cloud)
+    else:
+        # 件数が変わりうるためセッション一覧のキャッシュを破棄
+        _find_local_sessions.clear()
@@ -2,15 +2,19 @@
 Cloudflare R2 Storage Module
 - S3互換APIを使用した画像のアップロード・ダウンロード
 """
+import concurrent.futures
+import io
+import itertools
 import os
 import uuid
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Iterable, Optional, Union
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
 from botocore.config import Config
-from dotenv import load_dotenv
+from logic import load_env
 
-load_dotenv()
+load_env()
 
 # Streamlit Cloud対応: st.secretsとos.getenvの両方をサポート
 def _get_secret(key: str, default: str = None) -> str:
@@ -47,21 +51,40 @@ def get_bucket_name():
 # 後方互換性のため（実際は get_bucket_name() を使うこと）
 R2_BUCKET_NAME = "receipt-reader"  # デフォルト値。実行時は get_bucket_name() で取得
 
+def _content_type_for(ext: str) -> str:
+    """拡張子から Content-Type を推定"""
+    ext = ext.lower()
+    if ext in [".png"]:
+        return "image/png"
+    elif ext in [".heic", ".heif"]:
+        return "image/heic"
+    return "image/jpeg"
+
+
+# 認証情報ごとに生成済みクライアントを保持 (boto3クライアント生成は重く、スレッドセーフに共有可能)
+_r2_clients: dict = {}
+
+
 def get_r2_client():
-    """R2クライアントを取得"""
+    """R2クライアントを取得 (プロセス内で再利用)"""
     account_id, access_key, secret_key, bucket_name, endpoint = _get_r2_config()
     
     if not all([account_id, access_key, secret_key]):
         raise ValueError("R2 credentials not set. Check st.secrets or environment variables.")
     
-    return boto3.client(
-        "s3",
-        endpoint_url=endpoint,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        config=Config(signature_version="s3v4"),
-        region_name="auto"
-    )
+    key = (endpoint, access_key, secret_key)
+    client = _r2_clients.get(key)
+    if client is None:
+        client = boto3.client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(signature_version="s3v4"),
+            region_name="auto"
+        )
+        _r2_clients[key] = client
+    return client
 
 
 def upload_image(file_path: str, object_key: Optional[str] = None) -> str:
@@ -84,11 +107,7 @@ def upload_image(file_path: str, object_key: Optional[str] = None) -> str:
         object_key = f"images/{uuid.uuid4().hex}{ext}"
     
     # Content-Type を推定
-    content_type = "image/jpeg"
-    if path.suffix.lower() in [".png"]:
-        content_type = "image/png"
-    elif path.suffix.lower() in [".heic", ".heif"]:
-        content_type = "image/heic"
+    content_type = _content_type_for(path.suffix)
     
     with open(file_path, "rb") as f:
         client.put_object(
@@ -117,11 +136,7 @@ def upload_image_bytes(data: bytes, filename: str) -> str:
     ext = Path(filename).suffix.lower() or ".jpg"
     object_key = f"images/{uuid.uuid4().hex}{ext}"
     
-    content_type = "image/jpeg"
-    if ext in [".png"]:
-        content_type = "image/png"
-    elif ext in [".heic", ".heif"]:
-        content_type = "image/heic"
+    content_type = _content_type_for(ext)
     
     client.put_object(
         Bucket=get_bucket_name(),
@@ -133,6 +148,55 @@ def upload_image_bytes(data: bytes, filename: str) -> str:
     return object_key
 
 
+def _as_upload_body(data: Union[bytes, BinaryIO]) -> BinaryIO:
+    """
+    アップロード用のファイルオブジェクトを返す。
+    バイト列は BytesIO で包み、ファイルオブジェクトは先頭へ巻き戻す
+    (既に読み出し済みの場合に空データを送らないため)。
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return io.BytesIO(data)
+    if data.seekable():
+        data.seek(0)
+    return data
+
+
+def upload_many(items: list[tuple[str, Union[bytes, BinaryIO]]], max_concurrency: int = 8) -> list[str]:
+    """
+    複数ファイルを並列でR2にアップロード (TransferManager使用)
+    
+    Args:
+        items: [(オブジェクトキー, バイトデータ or ファイルオブジェクト), ...]
+               ファイルオブジェクトはチャンク単位で読み出される (全体をメモリに載せない)
+               Content-Type はキーの拡張子から推定
+        max_concurrency: 同時アップロード数
+    
+    Returns:
+        アップロードしたオブジェクトキーのリスト
+    """
+    if not items:
+        return []
+    
+    client = get_r2_client()
+    bucket = get_bucket_name()
+    config = TransferConfig(max_concurrency=max_concurrency, multipart_threshold=5 * 1024 * 1024)
+    
+    with create_transfer_manager(client, config) as tm:
+        futures = [
+            tm.upload(
+                _as_upload_body(data),
+                bucket, object_key,
+                extra_args={"ContentType": _content_type_for(Path(object_key).suffix)}
+            )
+            for object_key, data in items
+        ]
+        # 全件の完了を待つ (失敗があれば例外を送出)
+        for future in futures:
+            future.result()
+    
+    return [object_key for object_key, _ in items]
+
+
 def get_presigned_url(object_key: str, expires_in: int = 3600) -> str:
     """
     署名付きURLを生成（画像表示用）
@@ -155,6 +219,25 @@ def get_presigned_url(object_key: str, expires_in: int = 3600) -> str:
     return url
 
 
+def get_presigned_urls(object_keys: Iterable[str], expires_in: int = 3600) -> list[str]:
+    """
+    複数キーの署名付きURLをまとめて生成
+    クライアント・バケット名の解決は1回だけ行い、各キーは署名のみ
+    
+    Returns:
+        署名付きURL (入力と同じ順序)
+    """
+    object_keys = list(object_keys)
+    if not object_keys:
+        return []
+    sign = get_r2_client().generate_presigned_url
+    bucket = get_bucket_name()
+    return [
+        sign("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires_in)
+        for key in object_keys
+    ]
+
+
 def download_image(object_key: str) -> bytes:
     """
     R2から画像をダウンロード
@@ -190,24 +273,65 @@ def delete_image(object_key: str):
     )
 
 
-def list_images(prefix: str = "images/") -> list[str]:
+def _list_keys(client, bucket: str, prefix: str) -> list[str]:
+    """プレフィックス配下の全キーをページングしながら取得"""
+    keys = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        keys.extend(obj["Key"] for obj in response.get("Contents", ()))
+        if not response.get("IsTruncated"):
+            return keys
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def list_images(prefix: str = "images/", shards: Optional[Iterable[str]] = None,
+                max_concurrency: int = 8) -> list[str]:
     """
     R2の画像一覧を取得
     
     Args:
         prefix: 検索プレフィックス
+        shards: prefix に続くサブプレフィックス (例: "0".."9")。
+                指定すると各シャードを並列に一覧取得して結合する (キー数が多い場合用)
+        max_concurrency: シャード一覧の同時実行数
     
     Returns:
-        オブジェクトキーのリスト
+        オブジェクトキーのリスト (シャード指定時はシャード名順に結合)
     """
     client = get_r2_client()
+    bucket = get_bucket_name()
     
-    response = client.list_objects_v2(
-        Bucket=get_bucket_name(),
-        Prefix=prefix
-    )
+    if not shards:
+        return _list_keys(client, bucket, prefix)
     
-    if "Contents" not in response:
-        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        results = executor.map(lambda shard: _list_keys(client, bucket, prefix + shard), sorted(shards))
+        return list(itertools.chain.from_iterable(results))
+
+
+def count_images(prefix: str = "images/", limit: Optional[int] = None) -> int:
+    """
+    R2の画像数を数える (キー文字列のリストは作らない)
+    
+    Args:
+        prefix: 検索プレフィックス
+        limit: この件数に達したら打ち切る (存在確認だけなら 1)
+    
+    Returns:
+        オブジェクト数
+    """
+    client = get_r2_client()
     
-    return [obj["Key"] for obj in response["Contents"]]
+    count = 0
+    kwargs = {"Bucket": get_bucket_name(), "Prefix": prefix}
+    if limit:
+        kwargs["MaxKeys"] = min(limit, 1000)
+    while True:
+        response = client.list_objects_v2(**kwargs)
+        count += response.get("KeyCount", 0)
+        if limit and count >= limit:
+            return limit
+        if not response.get("IsTruncated"):
+            return count
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
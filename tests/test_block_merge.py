@@ -1,6 +1,7 @@
 
 import sys
 import os
+import re
 import unittest
 
 # プロジェクトルートにパスを通す
@@ -56,5 +57,32 @@ class TestBlockMerge(unittest.TestCase):
         print(f"Case 5: '{norm}' ({debug})")
         self.assertEqual(norm, "T1234567890123") 
 
+    def test_check_digit_preferred(self):
+        # ケース7: 候補が複数ある場合は検査用数字が一致する番号 (国税庁 T7000012050002) を優先
+        from logic.gemini_client import _invoice_check_digit_ok
+        self.assertTrue(_invoice_check_digit_ok("T7000012050002"))
+        self.assertFalse(_invoice_check_digit_ok("T1234567890123"))
+        text = "登録番号 T1234567890123 T7000012050002"
+        norm, debug, low_conf = _extract_invoice_no_from_text(text, "")
+        self.assertEqual(norm, "T7000012050002")
+        self.assertFalse(low_conf)
+
+    def test_label_scan_matches_regex(self):
+        # ケース6: Aho–Corasick の1パス探索と正規表現フォールバックが同じラベル位置を返す
+        from logic import gemini_client as g
+        text = "適格請求書発行事業者 登録番号 T123 インボイス 日付 2026/02/08 年月日"
+        regex_hits = g._find_labels(text, None, g._INVOICE_LABEL_RE, g._INVOICE_LABEL_KEYWORDS)
+        self.assertEqual(len(regex_hits), 4)  # 適格請求書 は 適格請求書発行事業者 の中でも検出
+        self.assertEqual(g._find_labels(text, g._INVOICE_LABEL_AC, g._INVOICE_LABEL_RE, g._INVOICE_LABEL_KEYWORDS), regex_hits)
+        # キーワードごとに個別に探した結果とも一致する
+        self.assertEqual(regex_hits, [
+            (i, m.start(), m.end())
+            for i, kw in enumerate(g._INVOICE_LABEL_KEYWORDS) for m in re.finditer(re.escape(kw), text)
+        ])
+        self.assertEqual(
+            g._find_labels(text, g._DATE_LABEL_AC, g._DATE_LABEL_RE, g._DATE_LABEL_KEYWORDS),
+            g._find_labels(text, None, g._DATE_LABEL_RE, g._DATE_LABEL_KEYWORDS),
+        )
+
 if __name__ == "__main__":
     unittest.main()
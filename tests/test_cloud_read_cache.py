@@ -0,0 +1,57 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic import data_layer
+
+
+class TestCloudReadCache(unittest.TestCase):
+    def setUp(self):
+        self.db = mock.Mock()
+        self.db.list_sessions.side_effect = lambda limit: [{"id": "s1"}]
+        self.db.get_receipts_by_session.side_effect = lambda sid, limit, offset: [{"id": "r1", "payee": "Shop"}]
+        patches = [
+            mock.patch.object(data_layer, "USE_CLOUD_BACKEND", True),
+            mock.patch.object(data_layer, "_cloud_reads", {}),
+            mock.patch.object(data_layer, "_get_db", return_value=self.db),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reads_cached_until_write(self):
+        """読み取りはキャッシュされ、書き込みで破棄されること (セッション一覧は sessions=True のみ)"""
+        data_layer.list_sessions()
+        data_layer.list_sessions()
+        first = data_layer.get_receipts("s1")
+        first[0]["payee"] = "changed"  # 呼び出し側の変更がキャッシュに影響しないこと
+        self.assertEqual(data_layer.get_receipts("s1")[0]["payee"], "Shop")
+        self.assertEqual(self.db.list_sessions.call_count, 1)
+        self.assertEqual(self.db.get_receipts_by_session.call_count, 1)
+
+        data_layer.update_receipt("r1", {"payee": "New"})
+        data_layer.get_receipts("s1")
+        data_layer.list_sessions()
+        self.assertEqual(self.db.get_receipts_by_session.call_count, 2)
+        self.assertEqual(self.db.list_sessions.call_count, 1)
+
+        data_layer.delete_session("s1")
+        data_layer.list_sessions()
+        self.assertEqual(self.db.list_sessions.call_count, 2)
+
+    def test_read_racing_a_write_not_cached(self):
+        """読み取り中に書き込みがあった結果はキャッシュしないこと"""
+        def list_and_write(limit):
+            data_layer._invalidate_cloud_reads(sessions=True)
+            return [{"id": "stale"}]
+        self.db.list_sessions.side_effect = list_and_write
+        data_layer.list_sessions()
+        self.assertEqual(data_layer._cloud_reads, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
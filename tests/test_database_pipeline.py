@@ -0,0 +1,172 @@
+
+import sys
+import os
+import json
+import unittest
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic import database
+
+
+def _ok_result(rows=None, cols=None):
+    return {
+        "type": "ok",
+        "response": {
+            "type": "execute",
+            "result": {
+                "cols": [{"name": c} for c in (cols or [])],
+                "rows": [[{"type": "text", "value": v} for v in row] for row in (rows or [])],
+            },
+        },
+    }
+
+
+def _batch_result(n_statements, error_step=None):
+    """BEGIN + n文 + COMMIT + ROLLBACK の batch 結果 (error_step で失敗させるステップを指定)"""
+    n_steps = n_statements + 3
+    results = [{"cols": [], "rows": []}] * (n_steps - 1) + [None]  # ROLLBACK は実行されない
+    errors = [None] * n_steps
+    if error_step is not None:
+        errors[error_step] = {"message": "SQLITE_CONSTRAINT"}
+        results = results[:error_step] + [None] * (n_steps - error_step - 1) + [{"cols": [], "rows": []}]
+    return {
+        "type": "ok",
+        "response": {"type": "batch", "result": {"step_results": results, "step_errors": errors}},
+    }
+
+
+class TestDatabasePipeline(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(database, "_get_turso_config", return_value=("https://db.example", "token"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _mock_post(self, results):
+        response = mock.Mock()
+        response.json.return_value = {"results": results}
+        response.content = json.dumps({"results": results}).encode("utf-8")
+        response.raise_for_status.return_value = None
+        return mock.patch.object(database._get_http_session(), "post", return_value=response)
+
+    def test_upsert_receipts_single_request(self):
+        """新規・更新が混在しても1回のPOSTで送られること"""
+        receipts = [
+            {"id": "r1", "payee": "Shop A", "total_amount": 1000, "is_confirmed": True},
+            {"payee": "Shop B", "total_amount": 2000},
+        ]
+        # batch (BEGIN + 2文 + COMMIT + ROLLBACK) + close
+        with self._mock_post([_batch_result(2), {"type": "ok"}]) as post:
+            ids = database.upsert_receipts("sess1", receipts)
+
+        self.assertEqual(post.call_count, 1)
+        reqs = post.call_args.kwargs["json"]["requests"]
+        self.assertEqual(reqs[0]["type"], "batch")
+        self.assertEqual(reqs[1]["type"], "close")
+        steps = reqs[0]["batch"]["steps"]
+        self.assertEqual(steps[0]["stmt"]["sql"], "BEGIN")
+        self.assertTrue(steps[1]["stmt"]["sql"].startswith("UPDATE receipts SET"))
+        self.assertIn("INSERT OR REPLACE INTO receipts", steps[2]["stmt"]["sql"])
+        self.assertEqual(steps[3]["stmt"]["sql"], "COMMIT")
+        self.assertEqual(steps[4]["stmt"]["sql"], "ROLLBACK")
+        # 各ステップは直前の成功が条件
+        self.assertEqual(steps[2]["condition"], {"type": "ok", "step": 1})
+        self.assertEqual(steps[3]["condition"], {"type": "ok", "step": 2})
+
+        self.assertEqual(ids[0], "r1")
+        self.assertTrue(ids[1])
+        # 同じバッチ内の updated_at は共通
+        self.assertEqual(steps[1]["stmt"]["args"][-2], steps[2]["stmt"]["args"][-1])
+
+    def test_transaction_error_raises(self):
+        """トランザクション内の1文が失敗したら例外になり、COMMIT扱いにしないこと"""
+        receipts = [{"id": "r1", "payee": "Shop A"}, {"payee": "Shop B"}]
+        with self._mock_post([_batch_result(2, error_step=2), {"type": "ok"}]):
+            with self.assertRaises(database.DatabaseError):
+                database.upsert_receipts("sess1", receipts)
+
+    def test_execute_error_raises(self):
+        """トランザクション外でもエラー結果は例外になること"""
+        error = {"type": "error", "error": {"message": "no such table: receipts"}}
+        with self._mock_post([error, {"type": "ok"}]):
+            with self.assertRaises(database.DatabaseError):
+                database.execute_sql("SELECT * FROM receipts")
+
+    def test_delete_session_single_request(self):
+        """delete_session がレシートとセッションの削除を1回のPOSTで送ること"""
+        with self._mock_post([_batch_result(2), {"type": "ok"}]) as post:
+            database.delete_session("sess1")
+
+        self.assertEqual(post.call_count, 1)
+        reqs = post.call_args.kwargs["json"]["requests"]
+        self.assertEqual([step["stmt"]["sql"] for step in reqs[0]["batch"]["steps"]], [
+            "BEGIN",
+            "DELETE FROM receipts WHERE session_id = ?",
+            "DELETE FROM sessions WHERE id = ?",
+            "COMMIT",
+            "ROLLBACK",
+        ])
+
+    def test_get_receipts_page(self):
+        """limit 指定時は LIMIT/OFFSET 付きで取得すること"""
+        cols = ["id", "payee", "total_amount", "payment_date", "tax_rate", "category",
+                "payment_method", "invoice_number", "invoice_candidates", "image_url", "image_path",
+                "status", "is_confirmed", "is_discarded"]
+        row = ["r1", "Shop", "100", "2026/02/08", "10", "other", "cash", "", "", "", "", "valid", "1", "0"]
+        with self._mock_post([_ok_result(rows=[row], cols=cols), {"type": "ok"}]) as post:
+            receipts = database.get_receipts_by_session("sess1", limit=50, offset=100)
+
+        stmt = post.call_args.kwargs["json"]["requests"][0]["stmt"]
+        self.assertTrue(stmt["sql"].rstrip().endswith("LIMIT ? OFFSET ?"))
+        self.assertEqual([a["value"] for a in stmt["args"]], ["sess1", "50", "100"])
+        self.assertEqual(receipts[0]["id"], "r1")
+        self.assertTrue(receipts[0]["is_confirmed"])
+        self.assertFalse(receipts[0]["is_discarded"])
+        self.assertEqual(receipts[0]["invoice_candidates"], [])
+        self.assertEqual(receipts[0]["payee"], "Shop")
+
+    def test_invoice_candidates_json(self):
+        """invoice_candidates は JSON配列で保存され、カンマを含む値や旧形式も復元できること"""
+        candidates = ["T1234567890123", "T98,76"]
+        _, args, _ = database._save_receipt_stmt("sess1", {"invoice_candidates": candidates})
+        self.assertEqual(database._load_candidates(args[9]), candidates)
+        self.assertEqual(database._load_candidates("T1,T2"), ["T1", "T2"])
+        self.assertEqual(database._load_candidates(""), [])
+        self.assertEqual(database._dump_candidates([]), "")
+
+    def test_update_receipt_stmt(self):
+        """部分更新は指定列のみを更新し、bool は 0/1 に変換されること"""
+        sql, values = database._update_receipt_stmt("r1", {"is_confirmed": True, "payee": "Shop", "unknown": 1})
+        self.assertEqual(sql, "UPDATE receipts SET payee = ?, is_confirmed = ?, updated_at = ? WHERE id = ?")
+        self.assertEqual(values[:2], ["Shop", 1])
+        self.assertEqual(values[-1], "r1")
+        self.assertIsNone(database._update_receipt_stmt("r1", {}))
+
+    def test_to_turso_args(self):
+        """各型が Turso のパラメータ形式に変換されること (bool は 0/1)"""
+        from logic.models import TaxRate
+        self.assertEqual(database._to_turso_args([None, True, 3, 1.5, "a", TaxRate.RATE_10]), [
+            {"type": "null"},
+            {"type": "integer", "value": "1"},
+            {"type": "integer", "value": "3"},
+            {"type": "float", "value": 1.5},
+            {"type": "text", "value": "a"},
+            {"type": "text", "value": TaxRate.RATE_10.value},
+        ])
+        self.assertEqual(database._to_turso_args(None), [])
+
+    def test_http_session_reused(self):
+        """HTTPセッションがプロセス内で使い回されること"""
+        self.assertIs(database._get_http_session(), database._get_http_session())
+
+    def test_execute_sql_parses_rows(self):
+        """execute_sql が従来通り columns/rows を返すこと"""
+        with self._mock_post([_ok_result(rows=[["1"]], cols=["test"]), {"type": "ok"}]):
+            result = database.execute_sql("SELECT 1 as test")
+        self.assertEqual(result, {"columns": ["test"], "rows": [["1"]]})
+
+
+if __name__ == "__main__":
+    unittest.main()
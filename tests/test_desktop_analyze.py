@@ -0,0 +1,84 @@
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+
+from logic.models import ReceiptRecord
+import ui.desktop
+
+
+def _fake_analyze(path, use_split_scan=False):
+    return [ReceiptRecord(date="2026/01/01", vendor="Shop", total_amount=100)]
+
+
+class TestDesktopAnalyze(unittest.TestCase):
+    def setUp(self):
+        self.orig_cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        os.makedirs(os.path.join("input", "inbox"))
+
+    def tearDown(self):
+        os.chdir(self.orig_cwd)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _click_analyze(self, at):
+        button = next(b for b in at.button if "解析" in b.label)
+        return button.click().run()
+
+    def test_inbox_analysis_saves_session(self):
+        """Inbox解析の結果がセッションの summary.json に保存され、2回目は同じセッションに追記されること"""
+        Image.new("RGB", (20, 20)).save(os.path.join("input", "inbox", "a.jpg"))
+        with mock.patch.object(ui.desktop, "analyze_receipt_image", side_effect=_fake_analyze):
+            at = AppTest.from_file(os.path.join(PROJECT_ROOT, "app.py"), default_timeout=30)
+            at.session_state.user_mode = "desktop"
+            at = self._click_analyze(at.run())
+            self.assertFalse(at.exception)
+
+            Image.new("RGB", (20, 20)).save(os.path.join("input", "inbox", "b.jpg"))
+            at = self._click_analyze(at.run())
+            self.assertFalse(at.exception)
+
+        self.assertEqual(len(at.session_state.records), 2)
+        [session] = os.listdir("output")
+        with open(os.path.join("output", session, "summary.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        self.assertEqual(data["total_receipts"], 2)
+        self.assertEqual([r["image_path"] for r in data["records"]],
+                         [os.path.join("input", "done", "a.jpg"), os.path.join("input", "done", "b.jpg")])
+        self.assertEqual(os.listdir(os.path.join("input", "inbox")), [])
+
+    def test_record_edit_shows_saved_after_rerun(self):
+        """編集を保存すると再描画後に「保存しました」が表示され、変更なしの保存では表示されないこと"""
+        Image.new("RGB", (20, 20)).save(os.path.join("input", "inbox", "a.jpg"))
+        with mock.patch.object(ui.desktop, "analyze_receipt_image", side_effect=_fake_analyze):
+            at = AppTest.from_file(os.path.join(PROJECT_ROOT, "app.py"), default_timeout=30)
+            at.session_state.user_mode = "desktop"
+            at = self._click_analyze(at.run())
+
+        save = next(b for b in at.button if "保存" in b.label)
+        at = save.click().run()
+        self.assertEqual([m.value for m in at.success], [])
+        self.assertIn("変更はありません", [m.value for m in at.info])
+
+        next(t for t in at.text_input if t.label == "店名").input("Shop B")
+        save = next(b for b in at.button if "保存" in b.label)
+        at = save.click().run()
+        self.assertFalse(at.exception)
+        self.assertIn("保存しました", [m.value for m in at.success])
+        self.assertEqual(at.session_state.records[0].vendor, "Shop B")
+
+
+if __name__ == "__main__":
+    unittest.main()
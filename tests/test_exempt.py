@@ -7,7 +7,7 @@ from datetime import datetime
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from logic.models import ReceiptRecord, TaxRate, Category, PaymentMethod
-from logic.exporter import convert_record_to_row, TAX_CLASS_EXEMPT, TAX_RATE_MAP
+from logic.exporter import convert_record_to_row, rows_to_csv_bytes, generate_csv_data, TAX_CLASS_EXEMPT, TAX_RATE_MAP
 
 class TestExemptSupport(unittest.TestCase):
     def test_exempt_tax_rate_mapping(self):
@@ -53,5 +53,39 @@ class TestExemptSupport(unittest.TestCase):
         self.assertEqual(row["借方消費税区分"], "2") # Purchase
         self.assertEqual(row["借方税率コード"], "4") # 10%
 
+    def test_csv_bytes(self):
+        """CSV bytes have a single BOM, header row and quoted commas"""
+        rec = ReceiptRecord(
+            date="2026/02/08",
+            vendor="Shop, Inc",
+            total_amount=500,
+            category=Category.OTHER,
+            payment_method=PaymentMethod.CASH,
+        )
+        raw = rows_to_csv_bytes([convert_record_to_row(rec)])
+
+        self.assertTrue(raw.startswith("\ufeff".encode("utf-8")))
+        self.assertFalse(raw[3:].startswith("\ufeff".encode("utf-8")))
+        lines = raw.decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0].split(",")[0], "日付")
+        self.assertIn('"Shop, Inc"', lines[1])
+
+    def test_generate_csv_data_split(self):
+        """Unconfirmed rows are skipped; rows missing mandatory fields go to invalid"""
+        ok = ReceiptRecord(date="2026/02/08", vendor="Shop A", total_amount=100,
+                           category=Category.OTHER, payment_method=PaymentMethod.CASH, is_confirmed=True)
+        bad = ReceiptRecord(date="", vendor="Shop B", total_amount=200,
+                            category=Category.UNKNOWN, payment_method=PaymentMethod.CASH, is_confirmed=True)
+        skipped = ReceiptRecord(date="2026/02/08", vendor="Shop C", total_amount=300, is_confirmed=False)
+
+        result = generate_csv_data([ok, bad, skipped])
+
+        self.assertEqual(result["valid"], [convert_record_to_row(ok)])
+        self.assertEqual(len(result["invalid"]), 1)
+        self.assertEqual(result["invalid"][0]["摘要"], "Shop B")
+        self.assertEqual(result["invalid"][0]["_error_reasons"], ["内部月", "借方勘定科目コード"])
+        self.assertEqual(bad.missing_fields, ["内部月", "借方勘定科目コード"])
+        self.assertEqual(generate_csv_data([skipped]), {"valid": [], "invalid": []})
+
 if __name__ == "__main__":
     unittest.main()
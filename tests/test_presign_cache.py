@@ -0,0 +1,47 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic import data_layer
+
+
+class TestPresignCache(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(data_layer, "_presigned", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fill(self, now):
+        for i in range(data_layer._PRESIGN_MAX_ENTRIES):
+            data_layer._presigned[f"k{i}"] = (f"url-k{i}", now + data_layer._PRESIGN_TTL)
+
+    def test_evict_keeps_requested_keys(self):
+        """上限時の削除で keep のキーは残り、期限切れは keep でも消えること"""
+        data_layer._presigned["old"] = ("url-old", 50.0)
+        self._fill(100.0)
+        data_layer._evict_presigned(100.0, keep=frozenset({"k0", "old"}))
+
+        self.assertIn("k0", data_layer._presigned)
+        self.assertNotIn("k1", data_layer._presigned)
+        self.assertNotIn("old", data_layer._presigned)
+        self.assertLess(len(data_layer._presigned), data_layer._PRESIGN_MAX_ENTRIES)
+
+    def test_presign_many_full_cache_with_hit(self):
+        """キャッシュが満杯でもヒットしたキーと新規キーの両方のURLを返すこと"""
+        self._fill(100.0)
+        storage = mock.Mock()
+        storage.get_presigned_urls.side_effect = lambda keys: [f"url-{k}" for k in keys]
+        with mock.patch.object(data_layer, "_get_storage", return_value=storage):
+            urls = data_layer._presign_many(["k0", "new1", "new1"], now=100.0)
+
+        self.assertEqual(urls, ["url-k0", "url-new1", "url-new1"])
+        storage.get_presigned_urls.assert_called_once_with(["new1"])
+        self.assertIn("new1", data_layer._presigned)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic import gemini_client
+
+
+RAW_RESPONSE = json.dumps([{
+    "date": "2026/02/08", "vendor": "Shop A", "total_amount": 1100,
+    "tax_rate": "10", "payment_clues": "cash", "ocr_full_text": "",
+}])
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        patches = [
+            mock.patch.object(gemini_client, "_LLM_CACHE_DIR", self.tmp_dir),
+            mock.patch.dict(os.environ, {"GEMINI_API_KEY": "key"}),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_same_image_skips_api(self):
+        """同じ画像の2回目はAPIを呼ばずにキャッシュから解析すること"""
+        with mock.patch.object(gemini_client, "_call_gemini", return_value=RAW_RESPONSE) as call:
+            first = gemini_client._analyze_single_image(b"image-bytes")
+            second = gemini_client._analyze_single_image(b"image-bytes")
+            gemini_client._analyze_single_image(b"other-image")
+
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(first[0].vendor, second[0].vendor)
+        self.assertEqual(second[0].backend_used, "Gemini")
+        self.assertFalse(first[0].needs_review)
+        self.assertEqual(first[0].missing_fields, [])
+
+    def test_failed_parse_not_cached(self):
+        """解析できない応答はキャッシュしないこと"""
+        with mock.patch.object(gemini_client, "_call_gemini", return_value="not json") as call:
+            gemini_client._analyze_single_image(b"image-bytes")
+            gemini_client._analyze_single_image(b"image-bytes")
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_disabled_cache_skips_hashing(self):
+        """キャッシュ無効時は画像のハッシュを計算しないこと"""
+        with mock.patch.object(gemini_client, "_LLM_CACHE_DIR", ""), \
+             mock.patch.object(gemini_client, "_response_cache_key") as key, \
+             mock.patch.object(gemini_client, "_call_gemini", return_value=RAW_RESPONSE):
+            records = gemini_client._analyze_single_image(b"image-bytes")
+        key.assert_not_called()
+        self.assertEqual(records[0].vendor, "Shop A")
+
+    def test_cache_key_includes_model(self):
+        """モデル名が変わるとキャッシュキーも変わること"""
+        key = gemini_client._response_cache_key(b"image-bytes")
+        with mock.patch.object(gemini_client, "GEMINI_MODEL", "other-model"):
+            self.assertNotEqual(gemini_client._response_cache_key(b"image-bytes"), key)
+
+    def test_retry_wait_uses_retry_delay(self):
+        """429 の retryDelay があればその秒数待ち、なければ指数バックオフになること"""
+        state = mock.Mock(attempt_number=1)
+        state.outcome.exception.return_value = Exception(
+            "429 RESOURCE_EXHAUSTED. {'details': [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '7s'}]}"
+        )
+        self.assertTrue(7 <= gemini_client._wait_before_retry(state) <= 8)
+
+        state.outcome.exception.return_value = Exception("503 UNAVAILABLE")
+        self.assertTrue(2 <= gemini_client._wait_before_retry(state) <= 3)
+        self.assertTrue(gemini_client._is_retryable_error(Exception("You have exhausted your capacity")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic.models import ReceiptRecord, TaxRate, PaymentMethod, Category
+from logic import data_layer, session_manager
+
+
+class TestSessionIO(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.summary_path = os.path.join(self.tmp_dir, "summary.json")
+        self.original = {"file": "test.jpg", "timestamp": "2026-02-08 10:00:00", "records": []}
+        with open(self.summary_path, "w", encoding="utf-8") as f:
+            json.dump(self.original, f, ensure_ascii=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _make_records(self):
+        r1 = ReceiptRecord(
+            date="2026/02/08", vendor="セブンイレブン", total_amount=1100,
+            invoice_no_norm="T1234567890123", subject="昼食",
+            category=Category.MEETING, payment_method=PaymentMethod.CASH,
+            tax_rate_detected=TaxRate.RATE_10, needs_review=False, missing_fields=[],
+        )
+        r2 = ReceiptRecord(
+            date="", vendor="Shop B", total_amount=2000,
+            needs_review=True, missing_fields=["date"],
+            merge_candidates=[{"vendor": "Shop B", "total_amount": 2000}],
+            merge_reason="Fuzzy Match (Date/Amount + Vendor)", group_id="fuzzy_1",
+        )
+        return [r1, r2]
+
+    def test_roundtrip(self):
+        """save_records → load_records で内容が保持されること"""
+        records = self._make_records()
+        session_manager.save_records(self.summary_path, records, dict(self.original), False)
+
+        loaded, data = session_manager.load_records(self.summary_path, False)
+        self.assertEqual(len(loaded), 2)
+        self.assertEqual(loaded[0].vendor, "セブンイレブン")
+        self.assertEqual(loaded[0].invoice_no_norm, "T1234567890123")
+        self.assertEqual(loaded[0].tax_rate_detected, TaxRate.RATE_10)
+        self.assertEqual(loaded[0].category, Category.MEETING)
+        self.assertEqual(loaded[1].missing_fields, ["date"])
+        self.assertEqual(loaded[1].group_id, "fuzzy_1")
+        self.assertEqual(loaded[1].merge_candidates, [{"vendor": "Shop B", "total_amount": 2000}])
+        self.assertEqual(data["file"], "test.jpg")
+
+    def test_counts_and_encoding(self):
+        """valid/invalid件数が書き込まれ、日本語がエスケープされないこと"""
+        session_manager.save_records(self.summary_path, self._make_records(), dict(self.original), False)
+
+        with open(self.summary_path, "r", encoding="utf-8") as f:
+            raw = f.read()
+        self.assertIn("セブンイレブン", raw)
+
+        data = json.loads(raw)
+        self.assertEqual(data["valid_count"], 1)
+        self.assertEqual(data["invalid_count"], 1)
+
+    def test_save_is_atomic(self):
+        """保存後に一時ファイルが残らず、書き込み失敗時は元のファイルが保持されること"""
+        session_manager.save_records(self.summary_path, self._make_records(), dict(self.original), False)
+        self.assertEqual(os.listdir(self.tmp_dir), ["summary.json"])
+
+        with open(self.summary_path, "rb") as f:
+            before = f.read()
+        with self.assertRaises(TypeError):
+            session_manager._write_json(self.summary_path, {"bad": object()})
+        with open(self.summary_path, "rb") as f:
+            self.assertEqual(f.read(), before)
+        self.assertEqual(os.listdir(self.tmp_dir), ["summary.json"])
+
+    def test_record_edit_log(self):
+        """1件編集は編集ログに追記され、読み込み時に反映、全件保存でログが消えること"""
+        records = self._make_records()
+        session_manager.save_records(self.summary_path, records, dict(self.original), False)
+
+        records[1].vendor = "Shop C"
+        records[1].is_confirmed = True
+        session_manager.save_record_edit(self.summary_path, records, 1, dict(self.original), False)
+        wal_path = self.summary_path + ".wal"
+        self.assertTrue(os.path.exists(wal_path))
+
+        with open(self.summary_path, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["records"][1]["vendor"], "Shop B")
+
+        loaded, data = session_manager.load_records(self.summary_path, False)
+        self.assertEqual(loaded[1].vendor, "Shop C")
+        self.assertTrue(loaded[1].is_confirmed)
+        self.assertEqual(loaded[0].vendor, "セブンイレブン")
+
+        session_manager.save_records(self.summary_path, loaded, data, False)
+        self.assertFalse(os.path.exists(wal_path))
+        loaded, _ = session_manager.load_records(self.summary_path, False)
+        self.assertEqual(loaded[1].vendor, "Shop C")
+
+    def test_record_edit_counts_and_compaction(self):
+        """編集ログの件数がセッション一覧に反映され、読み込み時にログが summary.json に反映されること"""
+        from logic import data_layer
+        base = os.path.join(self.tmp_dir, "output")
+        os.makedirs(os.path.join(base, "20260301_090000"))
+        summary_path = os.path.join(base, "20260301_090000", "summary.json")
+        records = self._make_records()
+        session_manager.save_records(summary_path, records, dict(self.original), False)
+
+        records[1].date = "2026/02/09"
+        records[1].missing_fields = []
+        session_manager.save_record_edit(summary_path, records, 1, dict(self.original), False)
+
+        [(_, _, data)] = data_layer.iter_local_summaries(base)
+        self.assertEqual((data["valid_count"], data["invalid_count"]), (2, 0))
+        self.assertEqual(data["records"][1]["date"], "2026/02/09")
+
+        loaded, _ = session_manager.load_records(summary_path, False)
+        self.assertEqual(loaded[1].date, "2026/02/09")
+        self.assertFalse(os.path.exists(summary_path + ".wal"))
+        with open(summary_path, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["valid_count"], 2)
+
+    def test_cloud_save_failure_keeps_ids(self):
+        """クラウド保存が失敗したら新規レコードにIDを記録しないこと"""
+        from unittest import mock
+        from logic import data_layer, database
+        records = self._make_records()
+        records[0]._cloud_id = "r1"
+
+        with mock.patch.object(data_layer, "batch_upsert_receipts", side_effect=database.DatabaseError("fail")):
+            with self.assertRaises(database.DatabaseError):
+                session_manager.save_records("sess1", records, {}, True)
+        self.assertEqual(records[0]._cloud_id, "r1")
+        self.assertFalse(getattr(records[1], "_cloud_id", ""))
+
+        with mock.patch.object(data_layer, "batch_upsert_receipts", return_value=["r1", "r2"]) as upsert:
+            session_manager.save_records("sess1", records, {}, True)
+        self.assertEqual(upsert.call_args.args[1][0]["id"], "r1")
+        self.assertNotIn("id", upsert.call_args.args[1][1])
+        self.assertEqual(records[1]._cloud_id, "r2")
+
+    def test_published_images_removed_with_session(self):
+        """ビューア用に公開した画像がセッション削除で消え、更新時は1ファイルに上書きされること"""
+        from ui import shared
+        static_dir = Path(self.tmp_dir) / "static"
+        session_dir = Path(self.tmp_dir) / "output" / "20260208_100000"
+        session_dir.mkdir(parents=True)
+        img = session_dir / "a.jpg"
+        img.write_bytes(b"jpeg")
+
+        orig_cwd = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            with mock.patch.object(data_layer, "STATIC_IMAGE_DIR", static_dir), \
+                 mock.patch.object(shared.st, "get_option", return_value=True):
+                url = shared._publish_static_image(str(img), os.path.getmtime(img), session_dir.name)
+                self.assertTrue(url.startswith(f"{shared.STATIC_URL_PREFIX}/{session_dir.name}/"))
+                os.utime(img, (1, 1))
+                shared._publish_static_image(str(img), 1.0, session_dir.name)
+                self.assertEqual(len(list((static_dir / session_dir.name).iterdir())), 1)
+                self.assertIsNone(shared._publish_static_image(str(img), 1.0, ""))
+
+                data_layer.delete_session(session_dir.name)
+        finally:
+            os.chdir(orig_cwd)
+        self.assertFalse(session_dir.exists())
+        self.assertFalse((static_dir / session_dir.name).exists())
+
+    def test_find_sessions_sorted(self):
+        """find_sessions がフォルダ名の降順で summary.json を持つセッションのみ返すこと"""
+        base = os.path.join(self.tmp_dir, "output")
+        for name in ["20260101_090000", "20260201_090000", "no_summary"]:
+            os.makedirs(os.path.join(base, name))
+        for name in ["20260101_090000", "20260201_090000"]:
+            with open(os.path.join(base, name, "summary.json"), "w", encoding="utf-8") as f:
+                json.dump({"total_receipts": 3, "timestamp": name}, f)
+
+        orig_base = session_manager.BASE_OUTPUT_DIR
+        session_manager.BASE_OUTPUT_DIR = session_manager.Path(base)
+        try:
+            sessions = session_manager.find_sessions(False)
+        finally:
+            session_manager.BASE_OUTPUT_DIR = orig_base
+
+        self.assertEqual([s["dir"] for s in sessions], ["20260201_090000", "20260101_090000"])
+        self.assertEqual(sessions[0]["total"], 3)
+        self.assertTrue(sessions[0]["path"].endswith("summary.json"))
+
+        # 並列読み込みでも順序・内容が同じであること
+        from logic import data_layer
+        self.assertEqual(
+            list(data_layer.iter_local_summaries(base, max_workers=4)),
+            list(data_layer.iter_local_summaries(base)),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
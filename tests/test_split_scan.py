@@ -1,8 +1,7 @@
 
 import os
 import sys
-import tempfile
-import shutil
+import io
 from PIL import Image
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -15,27 +14,41 @@ def test_split_image():
     img.save(img_path)
     
     try:
+        files_before = set(os.listdir("."))
         results = _split_image(img_path)
         print(f"Created {len(results)} splits.")
         
-        for path, offset in results:
-            print(f"Split path: {path}")
-            if not path.startswith(tempfile.gettempdir()) and not "/tmp/" in path and not "var/folders" in path:
-                print(f"ERROR: Split file created outside of temp dir: {path}")
+        for data, offset in results:
+            # クロップはメモリ上のJPEGバイト列 (一時ファイルを作らない = Streamlitの再読み込みも起きない)
+            if not isinstance(data, bytes) or Image.open(io.BytesIO(data)).format != "JPEG":
+                print(f"ERROR: Split is not in-memory JPEG: {offset}")
                 sys.exit(1)
-            
-            if not os.path.exists(path):
-                print(f"ERROR: Split file does not exist: {path}")
-                sys.exit(1)
-                
-            # Clean up individually (as the real code does)
-            os.remove(path)
-            
-        print("Success: Splits created in temp dir.")
+
+        if set(os.listdir(".")) != files_before:
+            print("ERROR: Split scan created files")
+            sys.exit(1)
+
+        # 右下クロップのオフセット (offset_y, offset_x, crop_h, crop_w, original_h, original_w)
+        assert results[3][1] == (50, 50, 50, 50, 100, 100)
+        print("Success: Splits kept in memory.")
         
     finally:
         if os.path.exists(img_path):
             os.remove(img_path)
 
+
+def test_split_crops_ready_for_upload():
+    # 大きい画像のクロップは送信サイズに縮小済みで、送信前に再エンコードされない
+    from logic.gemini_client import _prepare_upload_image, _UPLOAD_MAX_SIDE
+    buf = io.BytesIO()
+    Image.new("RGBA", (5000, 3000)).save(buf, "PNG")
+
+    results = _split_image(buf.getvalue())
+    assert len(results) == 5
+    for data, _ in results:
+        assert max(Image.open(io.BytesIO(data)).size) <= _UPLOAD_MAX_SIDE
+        upload, mime = _prepare_upload_image(data)
+        assert upload is data and mime == "image/jpeg"
+
 if __name__ == "__main__":
     test_split_image()
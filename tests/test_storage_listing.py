@@ -0,0 +1,72 @@
+
+import sys
+import os
+import unittest
+from unittest import mock
+
+# プロジェクトルートにパスを通す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic import storage
+
+
+class FakeClient:
+    """list_objects_v2 を1ページ2件でページングするダミー"""
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.calls = []
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        self.calls.append(Prefix)
+        matched = [k for k in self.keys if k.startswith(Prefix)]
+        start = int(ContinuationToken or 0)
+        page = matched[start:start + 2]
+        response = {"KeyCount": len(page)}
+        if page:
+            response["Contents"] = [{"Key": k} for k in page]
+        if start + 2 < len(matched):
+            response["IsTruncated"] = True
+            response["NextContinuationToken"] = str(start + 2)
+        return response
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f"https://r2.example/{Params['Bucket']}/{Params['Key']}?exp={ExpiresIn}"
+
+
+class TestListImages(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient([
+            "inbox/0_a.jpg", "inbox/0_b.jpg", "inbox/0_c.jpg",
+            "inbox/1_a.jpg", "inbox/2_a.jpg", "images/x.jpg",
+        ])
+        for name, value in (("get_r2_client", self.client), ("get_bucket_name", "bucket")):
+            patcher = mock.patch.object(storage, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_paginates(self):
+        """1000件制限を超えてもページングで全件返すこと"""
+        keys = storage.list_images("inbox/")
+        self.assertEqual(keys, [
+            "inbox/0_a.jpg", "inbox/0_b.jpg", "inbox/0_c.jpg", "inbox/1_a.jpg", "inbox/2_a.jpg",
+        ])
+
+    def test_shards(self):
+        """シャード指定時は各サブプレフィックスを取得して結合すること"""
+        keys = storage.list_images("inbox/", shards=["1", "0"])
+        self.assertEqual(keys, ["inbox/0_a.jpg", "inbox/0_b.jpg", "inbox/0_c.jpg", "inbox/1_a.jpg"])
+        self.assertEqual(set(self.client.calls), {"inbox/0", "inbox/1"})
+
+    def test_presigned_urls_batch(self):
+        """まとめて署名しても入力順のURLが返ること"""
+        urls = storage.get_presigned_urls(["images/b.jpg", "images/a.jpg"])
+        self.assertEqual(urls, [
+            "https://r2.example/bucket/images/b.jpg?exp=3600",
+            "https://r2.example/bucket/images/a.jpg?exp=3600",
+        ])
+        self.assertEqual(storage.get_presigned_urls([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
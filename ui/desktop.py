@@ -1,6 +1,11 @@
 import streamlit as st
 import pandas as pd
+import concurrent.futures
+import errno
+import functools
 import json
+import os
+import shutil
 from pathlib import Path
 from datetime import datetime
 import uuid
@@ -10,7 +15,7 @@ import sys
 try:
     from logic.models import ReceiptRecord, TaxRate, PaymentMethod, Category
     from logic import session_manager
-    from logic.exporter import generate_csv_data
+    from logic.exporter import generate_csv_data, rows_to_csv_bytes
     from logic.gemini_client import analyze_receipt_image, rescan_specific_area
 except ImportError:
     if "logic.models" in sys.modules:
@@ -22,12 +27,13 @@ except ImportError:
         session_manager = sys.modules["logic.session_manager"]
     if "logic.exporter" in sys.modules:
         generate_csv_data = sys.modules["logic.exporter"].generate_csv_data
+        rows_to_csv_bytes = sys.modules["logic.exporter"].rows_to_csv_bytes
     if "logic.gemini_client" in sys.modules:
         analyze_receipt_image = sys.modules["logic.gemini_client"].analyze_receipt_image
         rescan_specific_area = sys.modules["logic.gemini_client"].rescan_specific_area
 
 # UI Imports
-from ui.shared import render_zoomable_image, status_emoji, convert_heic_to_jpg, get_status
+from ui.shared import render_zoomable_image, record_status_emoji, count_review_confirmed, convert_heic_batch, list_image_names
 from ui.styles import (
     MODERN_CSS, render_step_indicator, render_stats_bar,
     render_receipt_card, render_empty_state
@@ -49,6 +55,25 @@ TAX_MAP = {
     TaxRate.RATE_8_REDUCED: "8% (軽減)", TaxRate.EXEMPT: "免税", TaxRate.UNKNOWN: "不明"
 }
 
+# 同時に解析する画像数 (APIのレート制限を考慮)
+ANALYZE_MAX_WORKERS = 6
+
+
+def _analyze_inbox_file(img_file: Path, done_dir: Path) -> list:
+    """Inbox画像を1枚解析し、処理済みをdoneフォルダへ移動 (ワーカースレッドで実行)"""
+    new_recs = analyze_receipt_image(str(img_file), use_split_scan=False)
+    dest = done_dir / img_file.name
+    for rec in new_recs or []:
+        rec.image_path = str(dest)  # 移動後の画像を表示に使う
+    try:
+        # 同一ファイルシステムなら rename 1回で済む (同名があれば上書き)
+        os.replace(img_file, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(str(img_file), str(dest))
+    return new_recs
+
 
 def render_desktop(use_cloud: bool):
     st.markdown(MODERN_CSS, unsafe_allow_html=True)
@@ -74,12 +99,10 @@ def render_desktop(use_cloud: bool):
         # Inbox count
         inbox_count = 0
         if use_cloud:
-            from logic.storage import list_images
-            inbox_count = len(list_images("inbox/"))
+            from logic.storage import count_images
+            inbox_count = count_images("inbox/")
         else:
-            inbox_dir = session_manager.INPUT_DIR
-            if inbox_dir.exists():
-                inbox_count = len(list(inbox_dir.glob("*")))
+            inbox_count = len(list_image_names(session_manager.INPUT_DIR))
 
         if inbox_count > 0:
             st.markdown(f"""
@@ -134,8 +157,7 @@ def render_desktop(use_cloud: bool):
     records = st.session_state.get("records", [])
 
     # ── Determine Step ──
-    review_count = sum(1 for r in records if r.needs_review or r.missing_fields)
-    confirmed_count = sum(1 for r in records if r.is_confirmed)
+    review_count, confirmed_count = count_review_confirmed(records)
     current_step = 1
     if records:
         current_step = 2
@@ -161,68 +183,90 @@ def render_desktop(use_cloud: bool):
             )
             if uploaded_files and st.button("📤 Inboxへ保存", type="primary"):
                 count = 0
+                saved_paths = []
+                cloud_items = []
                 for vid in uploaded_files:
-                    file_bytes = vid.read()
                     ext = Path(vid.name).suffix.lower()
                     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
                     uid = str(uuid.uuid4())[:8]
                     fname = f"{ts}_{uid}{ext}"
                     if use_cloud:
-                        from logic.storage import get_r2_client, get_bucket_name
-                        client = get_r2_client()
-                        client.put_object(
-                            Bucket=get_bucket_name(), Key=f"inbox/{fname}",
-                            Body=file_bytes, ContentType="image/jpeg"
-                        )
+                        # UploadedFile をそのまま渡してストリーミング送信
+                        cloud_items.append((f"inbox/{fname}", vid))
                     else:
                         session_manager.INPUT_DIR.mkdir(parents=True, exist_ok=True)
                         save_path = session_manager.INPUT_DIR / fname
                         with open(save_path, "wb") as f:
-                            f.write(file_bytes)
-                        convert_heic_to_jpg(save_path)
+                            shutil.copyfileobj(vid, f, length=1024 * 1024)
+                        saved_paths.append(save_path)
                     count += 1
+                # R2アップロード・HEIC変換はまとめて並列実行
+                if cloud_items:
+                    from logic.storage import upload_many
+                    upload_many(cloud_items)
+                convert_heic_batch(saved_paths)
                 st.success(f"✅ {count}枚を保存しました")
                 st.rerun()
 
         with col_info:
             st.markdown('<div class="section-title">解析</div>', unsafe_allow_html=True)
             # Inbox内の画像ファイル一覧
-            inbox_files = []
-            if session_manager.INPUT_DIR.exists():
-                inbox_files = [
-                    f for f in session_manager.INPUT_DIR.glob("*")
-                    if f.suffix.lower() in (".png", ".jpg", ".jpeg", ".heic", ".heif")
-                ]
+            inbox_files = [session_manager.INPUT_DIR / name for name in list_image_names(session_manager.INPUT_DIR)]
             if inbox_files:
                 st.caption(f"📁 Inbox: {len(inbox_files)}枚")
             
             if st.button("⚡ Inbox画像を解析", use_container_width=True, type="primary"):
                 if not inbox_files:
                     st.warning("Inboxに画像がありません。先にアップロードしてください。")
+                elif use_cloud and not current_session:
+                    st.warning("セッションがありません。先に新規セッションを作成してください。")
                 else:
                     status_container = st.status("AIがレシートを解析中...", expanded=True)
-                    records = session_manager.load_records()
+                    if current_session:
+                        summary_path = current_session["path"]
+                        records, original_data = session_manager.load_records(summary_path, use_cloud)
+                    else:
+                        # セッション未選択: 新しいセッションフォルダに保存
+                        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        new_dir = session_manager.BASE_OUTPUT_DIR / ts
+                        new_dir.mkdir(parents=True, exist_ok=True)
+                        summary_path = str(new_dir / "summary.json")
+                        records, original_data = [], {"timestamp": ts, "records": []}
                     success_count = 0
                     error_count = 0
                     done_dir = session_manager.INPUT_DIR.parent / "done"
                     done_dir.mkdir(parents=True, exist_ok=True)
                     
-                    for img_file in inbox_files:
-                        try:
-                            status_container.write(f"🔍 {img_file.name} を解析中...")
-                            new_recs = analyze_receipt_image(str(img_file), use_split_scan=False)
-                            if new_recs:
-                                for rec in new_recs:
-                                    rec.source_file = img_file.name
-                                    records.append(rec)
-                                success_count += len(new_recs)
-                            # 処理済みをdoneフォルダへ移動
-                            img_file.rename(done_dir / img_file.name)
-                        except Exception as e:
-                            status_container.write(f"❌ {img_file.name}: {e}")
-                            error_count += 1
+                    # 解析はAPI待ちが大半なので並列実行し、UI更新はメインスレッドで行う
+                    status_container.write(f"🔍 {len(inbox_files)}枚を解析中...")
+                    results = [None] * len(inbox_files)
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=ANALYZE_MAX_WORKERS) as executor:
+                        futures = {
+                            executor.submit(_analyze_inbox_file, img_file, done_dir): idx
+                            for idx, img_file in enumerate(inbox_files)
+                        }
+                        for future in concurrent.futures.as_completed(futures):
+                            idx = futures[future]
+                            img_file = inbox_files[idx]
+                            try:
+                                results[idx] = future.result()
+                                status_container.write(f"✅ {img_file.name}")
+                            except Exception as e:
+                                status_container.write(f"❌ {img_file.name}: {e}")
+                                error_count += 1
+
+                    # レコードはInboxの順序で追加する
+                    for new_recs in results:
+                        if new_recs:
+                            records.extend(new_recs)
+                            success_count += len(new_recs)
                     
-                    session_manager.save_records(records)
+                    original_data["total_receipts"] = len(records)
+                    session_manager.save_records(summary_path, records, original_data, use_cloud)
+                    # 保存した内容を表示中のセッションに反映 (再読み込みを省く)
+                    st.session_state.records = records
+                    st.session_state.original_data = original_data
+                    st.session_state.last_loaded_path = summary_path
                     status_container.update(
                         label=f"✅ 完了: {success_count}件解析 / {error_count}件エラー",
                         state="complete"
@@ -246,33 +290,36 @@ def render_desktop(use_cloud: bool):
 
         # Master table
         st.markdown('<div class="section-title">一覧</div>', unsafe_allow_html=True)
-        df_data = []
-        for i, r in enumerate(records):
-            if r.is_discarded:
-                continue
-            df_data.append({
-                "No": i + 1,
-                "日付": r.date,
-                "店名": r.vendor,
-                "金額": f"¥{r.total_amount:,}",
-                "区分": CAT_MAP.get(r.category, ""),
-                "状態": status_emoji(get_status(r))
-            })
-        st.dataframe(pd.DataFrame(df_data), use_container_width=True, hide_index=True)
-
-        # Editor
+        # 表示対象 (削除済み以外) を先に絞り込み、列ごとにまとめて組み立てる
+        visible = [(i, r) for i, r in enumerate(records) if not r.is_discarded]
+        df_data = {
+            "No": [i + 1 for i, _ in visible],
+            "日付": [r.date for _, r in visible],
+            "店名": [r.vendor for _, r in visible],
+            "金額": [f"¥{r.total_amount:,}" for _, r in visible],
+            "区分": [CAT_MAP.get(r.category, "") for _, r in visible],
+            "状態": [record_status_emoji(r) for _, r in visible],
+        }
+        event = st.dataframe(
+            pd.DataFrame(df_data), use_container_width=True, hide_index=True,
+            on_select="rerun", selection_mode="single-row", key="record_table"
+        )
+
+        # Editor (一覧の行クリックで編集対象を選択、未選択時は先頭)
         st.markdown('<div class="section-title">編集</div>', unsafe_allow_html=True)
-        selected_idx = st.number_input(
-            "編集する No を選択",
-            min_value=1, max_value=len(records), value=1
-        ) - 1
+        selected_rows = event.selection.rows
+        if selected_rows and selected_rows[0] < len(visible):
+            selected_idx = visible[selected_rows[0]][0]
+        else:
+            selected_idx = visible[0][0] if visible else 0
+        st.caption(f"No.{selected_idx + 1} を編集中 (一覧の行をクリックで切り替え)")
         rec = records[selected_idx]
 
         c1, c2 = st.columns([1, 1], gap="large")
 
         with c1:
             if rec.image_path:
-                render_zoomable_image(rec.image_path)
+                render_zoomable_image(rec.image_path, current_session["dir"] if current_session else "")
             else:
                 st.markdown(
                     render_empty_state("🖼", "画像なし", ""),
@@ -322,28 +369,41 @@ def render_desktop(use_cloud: bool):
                 is_confirmed = st.checkbox("✅ 確認完了", value=rec.is_confirmed)
 
                 if st.form_submit_button("💾 保存", type="primary", use_container_width=True):
-                    rec.date = new_date
-                    rec.vendor = new_vendor
-                    rec.total_amount = int(new_amount)
-                    rec.subject = new_subject
-                    rec.category = new_cat
-                    rec.payment_method = new_pay
-                    rec.tax_rate_detected = new_tax
-                    rec.invoice_no_norm = new_invoice
-                    rec.is_confirmed = is_confirmed
+                    updates = {
+                        "date": new_date,
+                        "vendor": new_vendor,
+                        "total_amount": int(new_amount),
+                        "subject": new_subject,
+                        "category": new_cat,
+                        "payment_method": new_pay,
+                        "tax_rate_detected": new_tax,
+                        "invoice_no_norm": new_invoice,
+                        "is_confirmed": is_confirmed,
+                    }
+                    # 変更がなければセッション全体の書き戻しを省略
+                    dirty = any(getattr(rec, k) != v for k, v in updates.items())
+                    for k, v in updates.items():
+                        setattr(rec, k, v)
                     if is_confirmed:
+                        dirty = dirty or rec.needs_review or "invoice_no_candidate" in rec.missing_fields
                         rec.needs_review = False
                         if "invoice_no_candidate" in rec.missing_fields:
                             rec.missing_fields.remove("invoice_no_candidate")
 
-                    session_manager.save_records(
-                        st.session_state.summary_path,
-                        records,
-                        st.session_state.original_data,
-                        use_cloud
-                    )
+                    if dirty:
+                        session_manager.save_record_edit(
+                            st.session_state.summary_path,
+                            records,
+                            selected_idx,
+                            st.session_state.original_data,
+                            use_cloud
+                        )
+                        # 一覧・集計を更新するため再描画 (変更なしなら不要)、完了表示は再描画後に出す
+                        st.session_state.edit_saved = True
+                        st.rerun()
+                    st.info("変更はありません")
+                if st.session_state.pop("edit_saved", False):
                     st.success("保存しました")
-                    st.rerun()
 
     # ━━━ Tab 3: Export ━━━
     with tab_export:
@@ -363,14 +423,13 @@ def render_desktop(use_cloud: bool):
 
         with col_b:
             if valid_rows:
-                import io
-                df_csv = pd.DataFrame(valid_rows)
-                csv_bytes = df_csv.to_csv(index=False).encode("utf-8-sig")
+                # CSVはクリック時に生成 (再描画ごとに作らない)
+                build_csv = functools.partial(rows_to_csv_bytes, valid_rows)
 
                 st.markdown("<div style='padding-top:1.5rem'></div>", unsafe_allow_html=True)
                 st.download_button(
                     "📥 CSVダウンロード (freee形式)",
-                    data=csv_bytes,
+                    data=build_csv,
                     file_name="receipts.csv",
                     mime="text/csv",
                     use_container_width=True,
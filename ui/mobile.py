@@ -1,16 +1,24 @@
 import streamlit as st
+import functools
+import shutil
 import uuid
-import socket
 from pathlib import Path
 from datetime import datetime
 from logic.session_manager import find_sessions, load_records, save_records, INPUT_DIR
 from logic.gemini_client import analyze_receipt_image
-from ui.shared import get_local_ip, convert_heic_to_jpg, render_zoomable_image, status_emoji, get_status
+from logic.exporter import generate_csv_data, rows_to_csv_bytes
+from ui.shared import count_review_confirmed, discover_lan_ips, convert_heic_batch, list_image_names, render_zoomable_image, status_emoji, get_status
 from ui.styles import (
     MODERN_CSS, render_step_indicator, render_stats_bar,
     render_receipt_card, render_empty_state
 )
 
+CAT_LABELS = {
+    "travel": "旅費交通費", "parking": "駐車場", "toll": "通行料",
+    "meeting": "会議費", "entertainment": "交際費", "supplies": "消耗品",
+    "dues": "諸会費", "other": "その他", "unknown": "未設定"
+}
+
 
 def render_mobile(use_cloud: bool):
     st.markdown(MODERN_CSS, unsafe_allow_html=True)
@@ -30,18 +38,16 @@ def render_mobile(use_cloud: bool):
     sessions = find_sessions(use_cloud)
     has_inbox = False
     if use_cloud:
-        from logic.storage import list_images
-        has_inbox = len(list_images("inbox/")) > 0
+        from logic.storage import count_images
+        has_inbox = count_images("inbox/", limit=1) > 0
     else:
-        inbox_dir = INPUT_DIR
-        has_inbox = inbox_dir.exists() and len(list(inbox_dir.glob("*"))) > 0
+        has_inbox = bool(list_image_names(INPUT_DIR))
 
     # Determine step: 1=upload, 2=confirm, 3=export
     current_step = 1
     if sessions:
         records, _ = load_records(sessions[0]["path"], use_cloud)
-        review_count = sum(1 for r in records if r.needs_review or r.missing_fields)
-        confirmed_count = sum(1 for r in records if r.is_confirmed)
+        review_count, confirmed_count = count_review_confirmed(records)
         if records:
             current_step = 2
         if records and review_count == 0 and confirmed_count > 0:
@@ -74,45 +80,34 @@ def render_mobile(use_cloud: bool):
 
             if submitted and uploaded_files:
                 count = 0
+                saved_paths = []
+                cloud_items = []
                 for vid in uploaded_files:
-                    file_bytes = vid.read()
                     ext = Path(vid.name).suffix.lower()
                     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
                     uid = str(uuid.uuid4())[:8]
                     fname = f"{ts}_{uid}{ext}"
 
                     if use_cloud:
-                        from logic.storage import get_r2_client, get_bucket_name
-                        client = get_r2_client()
-                        object_key = f"inbox/{fname}"
-                        content_type = "image/jpeg"
-                        if ext == ".png": content_type = "image/png"
-                        elif ext in [".heic", ".heif"]: content_type = "image/heic"
-                        client.put_object(
-                            Bucket=get_bucket_name(), Key=object_key,
-                            Body=file_bytes, ContentType=content_type
-                        )
+                        # UploadedFile をそのまま渡してストリーミング送信
+                        cloud_items.append((f"inbox/{fname}", vid))
                     else:
                         INPUT_DIR.mkdir(parents=True, exist_ok=True)
                         save_path = INPUT_DIR / fname
                         with open(save_path, "wb") as f:
-                            f.write(file_bytes)
-                        convert_heic_to_jpg(save_path)
+                            shutil.copyfileobj(vid, f, length=1024 * 1024)
+                        saved_paths.append(save_path)
                     count += 1
+                # R2アップロード・HEIC変換はまとめて並列実行
+                if cloud_items:
+                    from logic.storage import upload_many
+                    upload_many(cloud_items)
+                convert_heic_batch(saved_paths)
                 st.success(f"✅ {count}枚を送信しました")
 
         # Connection info (collapsed)
         with st.expander("📡 PCからアクセスする場合"):
-            ips = []
-            try:
-                for info in socket.getaddrinfo(socket.gethostname(), None):
-                    ip = info[4][0]
-                    if "." in ip and not ip.startswith("127."):
-                        ips.append(ip)
-                ips = sorted(list(set(ips)))
-            except:
-                ips = [get_local_ip()]
-            for ip in ips:
+            for ip in discover_lan_ips():
                 st.code(f"http://{ip}:8501", language="text")
 
     # ━━━━━━━━━━ Tab 2: Confirm ━━━━━━━━━━
@@ -135,12 +130,7 @@ def render_mobile(use_cloud: bool):
                 if rec.is_discarded:
                     continue
                 status = get_status(rec)
-                cat_map = {
-                    "travel": "旅費交通費", "parking": "駐車場", "toll": "通行料",
-                    "meeting": "会議費", "entertainment": "交際費", "supplies": "消耗品",
-                    "dues": "諸会費", "other": "その他", "unknown": "未設定"
-                }
-                cat_label = cat_map.get(rec.category.value, rec.category.value)
+                cat_label = CAT_LABELS.get(rec.category.value, rec.category.value)
 
                 st.markdown(
                     render_receipt_card(rec.vendor, rec.date, rec.total_amount, status, cat_label),
@@ -162,9 +152,6 @@ def render_mobile(use_cloud: bool):
                 unsafe_allow_html=True
             )
         else:
-            from logic.exporter import generate_csv_data
-            import pandas as pd
-
             csv_result = generate_csv_data(records)
             valid_rows = csv_result.get("valid", [])
             invalid_rows = csv_result.get("invalid", [])
@@ -180,12 +167,11 @@ def render_mobile(use_cloud: bool):
             """, unsafe_allow_html=True)
 
             if valid_rows:
-                import io
-                df_csv = pd.DataFrame(valid_rows)
-                csv_bytes = df_csv.to_csv(index=False).encode("utf-8-sig")
+                # CSVはクリック時に生成 (再描画ごとに作らない)
+                build_csv = functools.partial(rows_to_csv_bytes, valid_rows)
                 st.download_button(
                     "📥 CSVダウンロード",
-                    data=csv_bytes,
+                    data=build_csv,
                     file_name="receipts.csv",
                     mime="text/csv",
                     use_container_width=True,
@@ -1,24 +1,74 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import base64
+import concurrent.futures
+import hashlib
 import io
+import logging
+import os
+import shutil
 import socket
+import time
 from pathlib import Path
 import subprocess
+from typing import Optional
+import requests
 from PIL import Image as PILImage, ImageOps
 
+from logic import data_layer
+
+logger = logging.getLogger(__name__)
+
+# pillow-heif があれば HEIC/HEIF をPillowで直接デコードする (なければ sips にフォールバック)
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_AVAILABLE = True
+except ImportError:
+    HEIF_AVAILABLE = False
+
+# 画像拡張子・MIMEタイプ (呼び出しごとにリテラルを作らないようモジュールレベルで定義)
+IMAGE_EXTS = frozenset({".jpg", ".jpeg", ".png", ".heic", ".heif"})
+HEIC_EXTS = frozenset({".heic", ".heif"})
+BROWSER_IMAGE_EXTS = frozenset({".jpg", ".jpeg", ".png", ".webp"})
+MIME_BY_EXT = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Streamlit の静的ファイル配信 (server.enableStaticServing) で画像を配信するURL
+STATIC_URL_PREFIX = "app/static/receipts"
+
+# (missing_fields有無, needs_review) → インデックス = missing*2 + review
+_STATUS_LABELS = ("valid", "needs_review", "invalid", "needs_review")
+_STATUS_EMOJIS = ("✅", "⚠️", "❌", "⚠️")
+_EMOJI_BY_STATUS = {"valid": "✅", "needs_review": "⚠️", "invalid": "❌"}
+
+
+def _status_index(rec) -> int:
+    return (bool(rec.missing_fields) << 1) | bool(rec.needs_review)
+
+
 def get_status(rec) -> str:
     """ステータスラベルを返す"""
-    if not rec.missing_fields and not rec.needs_review:
-        return "valid"
-    elif rec.needs_review:
-        return "needs_review"
-    else:
-        return "invalid"
+    return _STATUS_LABELS[_status_index(rec)]
 
 
 def status_emoji(status: str) -> str:
-    return {"valid": "✅", "needs_review": "⚠️", "invalid": "❌"}.get(status, "❓")
+    return _EMOJI_BY_STATUS.get(status, "❓")
+
+
+def record_status_emoji(rec) -> str:
+    """レコードから直接ステータス絵文字を返す (ラベルを経由しない)"""
+    return _STATUS_EMOJIS[_status_index(rec)]
+
+
+def count_review_confirmed(records) -> tuple[int, int]:
+    """(要確認件数, 確認済み件数) を1パスで数える"""
+    review = confirmed = 0
+    for r in records:
+        if r.needs_review or r.missing_fields:
+            review += 1
+        if r.is_confirmed:
+            confirmed += 1
+    return review, confirmed
 
 
 def get_local_ip():
@@ -32,22 +82,102 @@ def get_local_ip():
         return "127.0.0.1"
 
 
+def iter_image_entries(directory):
+    """ディレクトリ内の画像ファイルの DirEntry を順に返す (Pathを生成しない)"""
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                yield entry
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _list_image_names(directory: str, sig: int) -> tuple[str, ...]:
+    """画像ファイル名一覧 (sig はキャッシュキー用のディレクトリ mtime)"""
+    return tuple(sorted(e.name for e in iter_image_entries(directory)))
+
+
+def list_image_names(directory) -> tuple[str, ...]:
+    """
+    ディレクトリ内の画像ファイル名一覧を返す。
+    ディレクトリの mtime をキーにキャッシュするため、ファイルの追加・移動があるまで再走査しない。
+    """
+    try:
+        sig = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return ()
+    return _list_image_names(str(directory), sig)
+
+
+# RFC1918 プライベートアドレス帯 (ネットワーク, マスク) を整数で保持
+_PRIVATE_V4_NETS = (
+    (0x0A000000, 0xFF000000),  # 10.0.0.0/8
+    (0xAC100000, 0xFFF00000),  # 172.16.0.0/12
+    (0xC0A80000, 0xFFFF0000),  # 192.168.0.0/16
+)
+
+
+def _is_rfc1918(address: str) -> bool:
+    """IPv4文字列がRFC1918のプライベート帯かを整数マスク比較で判定"""
+    try:
+        n = int.from_bytes(socket.inet_aton(address), "big")
+    except OSError:
+        return False
+    return any((n & mask) == net for net, mask in _PRIVATE_V4_NETS)
+
+
+@st.cache_resource(show_spinner=False)
+def discover_lan_ips() -> tuple[str, ...]:
+    """
+    LAN内 (プライベート) のIPv4アドレス一覧を返す。
+    psutil があればインターフェースを直接列挙し (DNS問い合わせなし)、
+    なければ getaddrinfo にフォールバックする。結果はプロセス内でキャッシュ。
+    """
+    ips = set()
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        for addrs in psutil.net_if_addrs().values():
+            for addr in addrs:
+                if addr.family == socket.AF_INET and _is_rfc1918(addr.address):
+                    ips.add(addr.address)
+    else:
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                if _is_rfc1918(info[4][0]):
+                    ips.add(info[4][0])
+        except OSError:
+            pass
+
+    if not ips:
+        ips.add(get_local_ip())
+    return tuple(sorted(ips))
+
+
 def convert_heic_to_jpg(input_path: Path) -> Path:
     """
-    HEIC/HEIFをJPEGに変換する (macOS sips利用)。
+    HEIC/HEIFをJPEGに変換する (pillow-heif利用、なければ macOS sips)。
     変換成功なら新しいパスを返す。失敗なら元のパスを返す。
     """
-    if input_path.suffix.lower() not in {".heic", ".heif"}:
+    if input_path.suffix.lower() not in HEIC_EXTS:
         return input_path
         
     out_path = input_path.with_suffix(".jpg")
     try:
-        # sips -s format jpeg input --out output
-        subprocess.run(
-            ["sips", "-s", "format", "jpeg", str(input_path), "--out", str(out_path)],
-            check=True,
-            capture_output=True
-        )
+        if HEIF_AVAILABLE:
+            # プロセス内でデコード (EXIF回転は焼き込む)
+            with PILImage.open(input_path) as im:
+                im = ImageOps.exif_transpose(im)
+                im.convert("RGB").save(out_path, "JPEG", quality=90, optimize=False)
+        else:
+            # sips -s format jpeg input --out output
+            subprocess.run(
+                ["sips", "-s", "format", "jpeg", str(input_path), "--out", str(out_path)],
+                check=True,
+                capture_output=True
+            )
         if out_path.exists():
             input_path.unlink() # 元ファイルを削除
             return out_path
@@ -57,73 +187,168 @@ def convert_heic_to_jpg(input_path: Path) -> Path:
     return input_path
 
 
-def render_zoomable_image(img_path: str):
+def convert_heic_batch(paths: list[Path]) -> list[Path]:
+    """
+    複数ファイルをまとめて変換する (convert_heic_to_jpg を並列実行)。
+    libheif はデコード中にGILを解放するためスレッドで並列化できる。
+    """
+    targets = [p for p in paths if p.suffix.lower() in HEIC_EXTS]
+    if len(targets) <= 1:
+        return [convert_heic_to_jpg(p) for p in paths]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(targets), os.cpu_count() or 1)) as executor:
+        converted = dict(zip(targets, executor.map(convert_heic_to_jpg, targets)))
+    return [converted.get(p, p) for p in paths]
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _load_display_image(img_path: str, version: float) -> tuple[str, str, int, int]:
+    """
+    表示用に画像を読み込み、(base64, MIMEタイプ, 幅, 高さ) を返す。
+    - EXIF回転を適用し、表示に不要な解像度は縮小してからbase64化
+    - version はキャッシュキー用 (ローカル: mtime / URL: 時間バケット)
+    - 幅・高さが0の場合はPILで開けず元データをそのまま返したことを示す
+    """
+    is_url = img_path.startswith("http://") or img_path.startswith("https://")
+    if is_url:
+        response = requests.get(img_path, timeout=10)
+        response.raise_for_status()
+        src = io.BytesIO(response.content)
+    else:
+        src = img_path
+
+    try:
+        with PILImage.open(src) as pil_img:
+            fmt = "PNG" if pil_img.format == "PNG" else "JPEG"
+            pil_img = ImageOps.exif_transpose(pil_img)
+            w, h = pil_img.size
+            # 表示高さの2倍 (最低1600px) まで縮小すれば十分
+            display_h = min(int(600 * h / w), 760)
+            limit = max(display_h * 2, 1600)
+            pil_img.thumbnail((limit, limit))
+            if fmt == "JPEG" and pil_img.mode not in ("RGB", "L"):
+                pil_img = pil_img.convert("RGB")
+            buf = io.BytesIO()
+            pil_img.save(buf, format=fmt)
+        mime = "image/png" if fmt == "PNG" else "image/jpeg"
+        return base64.b64encode(buf.getvalue()).decode(), mime, w, h
+    except Exception:
+        if is_url:
+            raise
+        # フォールバック: そのまま読み込み
+        with open(img_path, "rb") as f:
+            img_b64 = base64.b64encode(f.read()).decode()
+        ext = Path(img_path).suffix.lower().lstrip(".")
+        mime = MIME_BY_EXT.get(ext, "image/jpeg")
+        return img_b64, mime, 0, 0
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _probe_image_size(img_path: str, version: float) -> tuple[int, int]:
+    """
+    画像ヘッダだけを読んで (幅, 高さ) を返す (EXIF回転考慮)。
+    URLの場合は先頭64KBのみRange取得する。取得できなければ (0, 0)。
+    """
+    try:
+        if img_path.startswith("http://") or img_path.startswith("https://"):
+            response = requests.get(img_path, headers={"Range": "bytes=0-65535"}, timeout=10)
+            response.raise_for_status()
+            src = io.BytesIO(response.content)
+        else:
+            src = img_path
+        with PILImage.open(src) as pil_img:
+            w, h = pil_img.size
+            try:
+                orientation = pil_img.getexif().get(0x0112, 1)
+            except Exception:
+                orientation = 1
+        # EXIF Orientation 5〜8 は90度回転 → 幅と高さが入れ替わる
+        if orientation in (5, 6, 7, 8):
+            w, h = h, w
+        return w, h
+    except Exception:
+        return 0, 0
+
+
+def _publish_static_image(img_path: str, version: float, session_id: str) -> Optional[str]:
+    """
+    ローカル画像を static/receipts/<セッションID>/ に配置し、ブラウザから参照するURLを返す。
+    公開先はセッション削除時に一緒に消える (data_layer.delete_session)。
+    静的配信は認証なしで誰でも取得できるため、server.enableStaticServing を
+    明示的に有効にした場合のみ使う (既定は無効で base64 埋め込み)。
+    セッション未指定・静的配信が無効・ブラウザで表示できない形式の場合は None。
+    """
+    ext = Path(img_path).suffix.lower()
+    if not session_id or ext not in BROWSER_IMAGE_EXTS:
+        return None
+    try:
+        if not st.get_option("server.enableStaticServing"):
+            return None
+    except Exception:
+        return None
+
+    # 元画像ごとに1ファイル (更新時は上書きし、古い版を溜めない)
+    session_name = Path(session_id).name
+    name = hashlib.sha1(os.path.abspath(img_path).encode("utf-8")).hexdigest() + ext
+    dest_dir = data_layer.STATIC_IMAGE_DIR / session_name
+    dest = dest_dir / name
+    try:
+        published = dest.stat().st_mtime == version
+    except OSError:
+        published = False
+    if not published:
+        tmp = dest_dir / f".{name}.{os.getpid()}.tmp"
+        try:
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(img_path, tmp)  # 同一FSならハードリンク (コピー不要)
+            except OSError:
+                shutil.copy2(img_path, tmp)
+            os.replace(tmp, dest)
+        except OSError as e:
+            logger.warning("Static publish failed: %s", e)
+            tmp.unlink(missing_ok=True)
+            return None
+    # ブラウザキャッシュは版ごとに分ける
+    return f"{STATIC_URL_PREFIX}/{session_name}/{name}?v={version}"
+
+
+def render_zoomable_image(img_path: str, session_id: str = ""):
     """
     パン＆ズーム画像ビューア。
+    session_id: ローカル画像の公開先セッション (未指定なら base64 で埋め込む)
     - ホイール: ズームイン/アウト
     - ドラッグ: パン
     - ダブルクリック: リセット
-    - クラウドURL対応
-    - iPhone EXIF回転対応
+    - クラウドURL対応 (署名付きURLをそのまま<img src>に使用)
+    - iPhone EXIF回転対応 (ブラウザ側で image-orientation により適用)
     """
     
-    # URLの場合はrequestsで取得、ローカルファイルの場合は直接読み込み
-    if img_path.startswith("http://") or img_path.startswith("https://"):
-        import requests
+    # URLの場合は10分単位、ローカルファイルの場合はmtimeでキャッシュ
+    is_url = img_path.startswith("http://") or img_path.startswith("https://")
+    if is_url:
+        version = float(int(time.time() // 600))
+    else:
+        # Check if file exists (only for local paths)
+        if not Path(img_path).exists():
+            st.error(f"画像が見つかりません: {img_path}")
+            return
+        version = os.path.getmtime(img_path)
+
+    # 画像本体はHTMLに埋め込まず、URLで参照させる
+    img_src = img_path if is_url else _publish_static_image(img_path, version, session_id)
+    if img_src:
+        w, h = _probe_image_size(img_path, version)
+    else:
+        # 静的配信が使えない場合: base64データURIにフォールバック
         try:
-            response = requests.get(img_path, timeout=10)
-            response.raise_for_status()
-            img_data = response.content
-            
-            # EXIF回転を適用してからbase64化
-            with PILImage.open(io.BytesIO(img_data)) as pil_img:
-                pil_img = ImageOps.exif_transpose(pil_img)
-                w, h = pil_img.size
-                display_h = min(int(600 * h / w), 760)
-                # 回転済み画像をbase64化
-                buf = io.BytesIO()
-                fmt = pil_img.format or "JPEG"
-                pil_img.save(buf, format=fmt)
-                img_b64 = base64.b64encode(buf.getvalue()).decode()
-            
-            # MIMEタイプ
-            content_type = response.headers.get("Content-Type", "image/jpeg")
-            mime = content_type.split(";")[0].strip()
+            img_b64, mime, w, h = _load_display_image(img_path, version)
         except Exception as e:
             st.error(f"画像の読み込みに失敗しました: {e}")
             return
-    else:
-        # ローカルファイル: EXIF回転を適用
-        try:
-            # Check if file exists (only for local paths)
-            if not Path(img_path).exists():
-                 st.error(f"画像が見つかりません: {img_path}")
-                 return
-
-            with PILImage.open(img_path) as pil_img:
-                pil_img = ImageOps.exif_transpose(pil_img)
-                w, h = pil_img.size
-                display_h = min(int(600 * h / w), 760)
-                # 回転済み画像をbase64化
-                buf = io.BytesIO()
-                fmt = pil_img.format or "JPEG"
-                pil_img.save(buf, format=fmt)
-                img_b64 = base64.b64encode(buf.getvalue()).decode()
-        except Exception:
-            # フォールバック: そのまま読み込み
-            if Path(img_path).exists():
-                with open(img_path, "rb") as f:
-                    img_b64 = base64.b64encode(f.read()).decode()
-            else:
-                st.error("画像読み込みエラー")
-                return
-            display_h = 650
+        img_src = f"data:{mime};base64,{img_b64}"
 
-        ext = Path(img_path).suffix.lower().lstrip(".")
-        mime = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg",
-                "webp": "image/webp"}.get(ext, "image/jpeg")
-    
-    data_url = f"data:{mime};base64,{img_b64}"
+    display_h = min(int(600 * h / w), 760) if w and h else 650
 
     html = f"""
     <style>
@@ -137,6 +362,7 @@ def render_zoomable_image(img_path: str):
         position: absolute; top: 0; left: 0;
         transform-origin: 0 0;
         will-change: transform;
+        image-orientation: from-image;
         user-select: none; -webkit-user-drag: none;
       }}
       .pz-hud {{
@@ -152,7 +378,7 @@ def render_zoomable_image(img_path: str):
       .pz-hud .pz-label {{ cursor: default; min-width: 48px; text-align: center; }}
     </style>
     <div class="pz-wrap" id="pzw">
-      <img src="{data_url}" id="pzi" />
+      <img src="{img_src}" id="pzi" />
       <div class="pz-hud">
         <button id="pzm" title="ズームアウト">−</button>
         <div class="pz-label" id="pzl">100%</div>
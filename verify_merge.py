@@ -30,4 +30,6 @@ def verify_multi_02():
             print(f"  Representative: {r.vendor} ({r.total_amount})")
 
 if __name__ == "__main__":
+    import logic
+    logic.configure_logging()
     verify_multi_02()